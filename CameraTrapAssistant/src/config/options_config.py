@@ -12,4 +12,5 @@ class OptionsConfig:
     get_gps_from_each_file: bool
     use_gps_only_for_data: bool
     combine_with_data: bool
-    time_offset: str  # 'auto' or timezone offset like 'UTC+02:00'
\ No newline at end of file
+    time_offset: str  # 'auto' or timezone offset like 'UTC+02:00'
+    only_new_files: bool  # only process the files new or changed since the last run, see run_manifest (and the photos of their sequences, predicted again)
\ No newline at end of file
@@ -0,0 +1,21 @@
+from dataclasses import dataclass
+
+@dataclass
+class PerformanceConfig:
+    workers: int = 0  # prediction processes, 0 for one per threads_per_worker cores
+    threads_per_worker: int = 0  # torch threads of each prediction process, 0 for the hardware profile (tools/autotune.py) or 4
+    prefetch_workers: int = 2  # threads reading and decoding the next files while the models run, 0 to disable
+    prefetch_memory_mb: int = 1024  # cap on decoded data read ahead
+    frame_sampling: str = "auto"  # how video frames are read: 'auto', 'grab' (forward decoding) or 'seek'
+    video_early_exit: bool = False  # stop analysing the frames of a video once its prediction is stable
+    motion_prefilter: bool = False  # skip the detector on frames/images without motion in their video/sequence, as empty
+    motion_min_area: float = 0.002  # fraction of changed pixels under which a frame/image has no motion, lower is more conservative
+    pipeline_stages: str = "auto"  # classify a batch while the next one is detected: 'auto' (on GPU only), 'on' or 'off'
+    reduced_decode: bool = False  # decode large JPEG photos near the detector input size, crops at full resolution (detections may differ slightly)
+    share_models: bool = True  # load the models once and share them with the prediction processes (CPU only); the GUI process then holds the weights (about 1.3 GB, in shared memory with the processes) while they are alive, except the int8 classifier, copied in each process
+    compile_classifier: bool = False  # torch.compile the classifier, needs a C++ compiler, kernels cached on disk
+    classifier_precision: str = "fp32"  # 'fp32', 'bf16' or 'int8', used only once validated by tools/validate_classifier_precision.py
+    backend: str = "torch"  # 'torch' or 'onnx' (models exported by tools/export_onnx.py, run by ONNX Runtime)
+    prediction_cache_mb: int = 1024  # on-disk cache of the model outputs by file content, so that re-runs skip inference, 0 to disable
+    checkpoint_interval: int = 60  # seconds between checkpoints of the predictions, resumed by a new run of the same files with the same models and workers, 0 to disable
+    worker_idle_timeout: int = 600  # seconds the GUI keeps the prediction processes loaded between runs, 0 to start them for each run
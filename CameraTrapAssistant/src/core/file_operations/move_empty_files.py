@@ -6,12 +6,13 @@ def moveEmptyVideos(folder, filenames, predicted_classes):
     logging.info("Moving empty videos to 'empty/' subfolder...")
     empty_folder = os.path.join(folder, "empty")
     os.makedirs(empty_folder, exist_ok=True)
-    for fname, pred in zip(filenames, predicted_classes):
+    for i, (fname, pred) in enumerate(zip(filenames, predicted_classes)):
         if str(pred).strip().lower() == "empty":
             try:
                 dest = os.path.join(empty_folder, os.path.basename(fname))
                 if not os.path.exists(dest):
                     os.rename(fname, dest)
+                    filenames[i] = dest # updating the list
             except Exception as e:
                 logging.info(f"Could not move {fname} to empty/: {e}")
 
@@ -20,11 +21,12 @@ def moveUndefinedVideos(folder, filenames, predicted_classes):
     logging.info("Moving undefined videos to 'undefined/' subfolder...")
     undefined_folder = os.path.join(folder, "undefined")
     os.makedirs(undefined_folder, exist_ok=True)
-    for fname, pred in zip(filenames, predicted_classes):
+    for i, (fname, pred) in enumerate(zip(filenames, predicted_classes)):
         if str(pred).strip().lower() == "undefined":
             try:
                 dest = os.path.join(undefined_folder, os.path.basename(fname))
                 if not os.path.exists(dest):
                     os.rename(fname, dest)
+                    filenames[i] = dest # updating the list
             except Exception as e:
                 logging.info(f"Could not move {fname} to undefined/: {e}")
\ No newline at end of file
@@ -0,0 +1,82 @@
+# Manifest of the files processed in a folder, saved in its 'data' subfolder,
+# so that a new run only predicts the files that are new or changed since the last one
+import datetime
+import json
+import logging
+import os
+
+MANIFEST_NAME = "run_manifest.json"
+MANIFEST_VERSION = 1
+
+def _manifest_path(folder):
+    return os.path.join(folder, "data", MANIFEST_NAME)
+
+def _relative_path(folder, filename):
+    return os.path.relpath(filename, folder).replace(os.sep, "/")
+
+def _file_state(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+def load_manifest(folder, settings):
+    """
+    Returns the entries of the manifest of folder by path relative to folder,
+    or no entry if there is none or if it was saved with other prediction settings.
+    """
+    try:
+        with open(_manifest_path(folder), encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("settings") != settings:
+        logging.info("Prediction settings changed since the last run, all files will be predicted again")
+        return {}
+    return manifest["files"]
+
+def split_processed(folder, filenames, entries):
+    """
+    Returns the entries of the files already processed, by index in filenames, when their size and
+    modification time did not change, and the indices of the other files, to predict.
+    """
+    processed = {}
+    new = []
+    for k, filename in enumerate(filenames):
+        entry = entries.get(_relative_path(folder, filename))
+        if entry is not None and tuple(entry["state"]) == _file_state(filename):
+            processed[k] = entry
+        else:
+            new.append(k)
+    return processed, new
+
+def entry_results(entry):
+    """
+    Returns the prediction, score, date, count, GPS coordinates and address of a manifest entry.
+    """
+    date = datetime.datetime.fromisoformat(entry["date"]) if entry["date"] else None
+    return entry["prediction"], entry["score"], date, entry["count"], tuple(entry["gps"]), entry["address"]
+
+def save_manifest(folder, filenames, prediction_results, gps_coordinates, addresses, settings):
+    """
+    Saves the results of all files, at their final location once renamed or moved by the run.
+    """
+    files = {}
+    for k, filename in enumerate(filenames):
+        if not os.path.isfile(filename):
+            continue
+        date = prediction_results["dates"][k]
+        files[_relative_path(folder, filename)] = {
+            "state": _file_state(filename),
+            "prediction": prediction_results["predictions"][k],
+            "score": float(prediction_results["scores"][k]),
+            "date": date.isoformat() if date else None,
+            "count": int(prediction_results["counts"][k]),
+            "gps": gps_coordinates[k],
+            "address": addresses[k]
+        }
+    os.makedirs(os.path.join(folder, "data"), exist_ok=True)
+    path = _manifest_path(folder)
+    # written next to the previous manifest then swapped, not to lose it if interrupted
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "settings": settings, "files": files}, f)
+    os.replace(path + ".tmp", path)
+    logging.info(f"Run manifest saved in {path}")
@@ -0,0 +1,80 @@
+import hashlib
+import logging
+import os
+import pickle
+import time
+
+CHECKPOINT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "deepfaune", "checkpoints")
+CHECKPOINT_MAXAGE = 30 # days after which the checkpoint of an abandoned run is removed
+# performance settings changing the predictions, a checkpoint is only resumed with the same ones
+CHECKPOINT_SETTINGS = ["video_early_exit", "motion_prefilter", "motion_min_area", "reduced_decode", "classifier_precision", "backend"]
+
+def checkpoint_path(filenames, is_video, threshold, LANG, performance_config, modelid=None):
+    """
+    Path of the checkpoint of a prediction job, identified by its files (with their size and
+    modification time), its type, the settings changing its predictions and the identifier of
+    its models (see PredictorBase.getModelId), so that updated weights start over.
+    The files are the ones of a prediction process: the path depends on how the files are split
+    between the processes, a run with another number of workers does not resume.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(repr((is_video, threshold, LANG, [getattr(performance_config, name) for name in CHECKPOINT_SETTINGS], modelid)).encode())
+    for filename in filenames:
+        try:
+            stat = os.stat(filename)
+            state = (stat.st_size, stat.st_mtime_ns)
+        except OSError:
+            state = None
+        digest.update(repr((filename, state)).encode())
+    return os.path.join(CHECKPOINT_DIR, digest.hexdigest() + ".pkl")
+
+def load_checkpoint(path):
+    """
+    Returns the state saved by save_checkpoint, None if there is none or if it cannot be read.
+    """
+    prune_checkpoints()
+    try:
+        with open(path, "rb") as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Could not read checkpoint {path}: {e}")
+        return None
+
+def save_checkpoint(path, state):
+    """
+    Saves the state durably: written next to the previous checkpoint, flushed to disk, then swapped,
+    so that a crash at any time leaves a complete checkpoint.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    try:
+        with open(path + ".tmp", "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        logging.warning(f"Could not save checkpoint {path}: {e}")
+
+def prune_checkpoints(maxage=CHECKPOINT_MAXAGE):
+    """
+    Removes the checkpoints not saved for maxage days, left by runs that were abandoned or whose files or settings changed.
+    """
+    try:
+        entries = list(os.scandir(CHECKPOINT_DIR))
+    except FileNotFoundError:
+        return
+    for entry in entries:
+        try:
+            if entry.stat().st_mtime < time.time() - maxage*86400:
+                os.remove(entry.path)
+        except OSError: # removed by another process
+            pass
+
+def remove_checkpoint(path):
+    for filename in [path, path + ".tmp"]:
+        try:
+            os.remove(filename)
+        except FileNotFoundError:
+            pass
@@ -1,19 +1,117 @@
 import logging
 from logging.handlers import QueueListener
+import multiprocessing
 from multiprocessing import Manager
 from concurrent.futures import ProcessPoolExecutor
 import os
 import datetime
 import sys
+import threading
+import time
 
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from utils.time_utils.dateParser import parse_dates
 from utils.time_utils.timeOffsetToTimezone import convert_to_timezone
+from config.performance_config import PerformanceConfig
+from core.prediction.checkpoint import checkpoint_path, load_checkpoint, save_checkpoint, remove_checkpoint
 
-def _predict_videos_worker(filenames, threshold, timezone, LANG, log_queue, is_video):
+VIDEO_FRAMES_PER_FILE = 12 # frames analysed per video, PredictorVideo BATCH_SIZE
+PHOTO_BATCH_SIZE = 8 # PredictorImage BATCH_SIZE without hardware profile
+THREADS_PER_WORKER = 4 # torch threads of each worker without hardware profile
+PHOTO_MAXLAG = 10 # seconds between two photos of the same sequence
+RESULT_KEYS = ["predictions", "scores", "dates", "counts"]
+MODELS_DIR = str(Path(__file__).parent.parent.parent / "models")
+
+_shared_models = None # ModelHost of this worker process, loaded by the parent or by the worker
+_default_nbthreads = None # torch threads of this worker process when it is the only one
+
+def _use_models_dir():
+    if MODELS_DIR not in sys.path:
+        sys.path.insert(0, MODELS_DIR)
+
+def _hardware_profile():
+    """
+    Batch size and threads measured on this machine by tools/autotune.py, if any.
+    """
+    _use_models_dir()
+    from hardwareProfile import loadHardwareProfile
+    return loadHardwareProfile()
+
+def _init_worker(models=None, warm_up=False, performance_config=None):
+    """
+    Initializer of the worker processes, keeps the models loaded by the parent,
+    or loads them once for all the jobs of this process.
+    """
+    global _shared_models, _default_nbthreads
+    if performance_config is None:
+        performance_config = PerformanceConfig()
+    _use_models_dir()
+    import torch
+    _default_nbthreads = torch.get_num_threads()
+    interop_threads = _hardware_profile().get("interop_threads")
+    if interop_threads:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError: # inter-op pool already started in this process, kept as is
+            pass
+    if models is None:
+        models = _load_models(performance_config, device="auto")
+    else: # loaded by the parent
+        models.setUpProcess()
+    _shared_models = models
+    if warm_up:
+        _shared_models.warmUp()
+
+class _Checkpointer:
+    """
+    Saves the state of a predictor every performance_config.checkpoint_interval seconds,
+    so that a new run of the same job, with the same models, resumes after the last complete batch.
+    """
+    def __init__(self, filenames, is_video, threshold, LANG, performance_config, shard=""):
+        self.interval = performance_config.checkpoint_interval
+        self.job = (filenames, is_video, threshold, LANG, performance_config)
+        self.path = None # known once the models are loaded, see resume
+        self.shard = shard
+        self.last_save = time.monotonic()
+
+    def resume(self, predictor):
+        if self.interval > 0:
+            self.path = checkpoint_path(*self.job, predictor.getModelId())
+        checkpoint = load_checkpoint(self.path) if self.path is not None else None
+        if checkpoint is not None and predictor.restoreCheckpoint(checkpoint):
+            logging.info(f"Resuming from checkpoint, {checkpoint['k1']} files already predicted{self.shard}")
+
+    def update(self, predictor):
+        if self.path is not None and time.monotonic() - self.last_save >= self.interval:
+            save_checkpoint(self.path, predictor.getCheckpoint())
+            self.last_save = time.monotonic()
+
+    def complete(self):
+        if self.path is not None:
+            remove_checkpoint(self.path)
+
+def _load_models(performance_config, device="cpu", context=None):
+    """
+    Loads the models with the inference settings of performance_config.
+    """
+    _use_models_dir()
+    from modelHost import ModelHost
+    return ModelHost(device=device, context=context,
+                     compile=performance_config.compile_classifier,
+                     precision=performance_config.classifier_precision,
+                     backend=performance_config.backend,
+                     nbthreads=_worker_threads(performance_config))
+
+def _worker_ready():
+    return os.getpid()
+
+def _predict_videos_worker(filenames, threshold, timezone, LANG, log_queue, is_video, performance_config, nbthreads=None, shard="", dates=None):
     """
     Runs in a separate process and sends log messages to the parent via a queue.
+    nbthreads limits the threads used by torch in this process, when several workers share the CPU.
+    shard names the part of the files handled by this worker in the log messages.
+    dates are the photo dates already read by the parent, by filename (see _shard_photos).
     """
     import logging
     from logging.handlers import QueueHandler
@@ -27,32 +125,74 @@ def _predict_videos_worker(filenames, threshold, timezone, LANG, log_queue, is_v
     root_logger.addHandler(queue_handler)
 
     # Import predictor inside subprocess
-    from pathlib import Path
-    current_file_dir = Path(__file__).parent.parent.parent  # src/
-    sys.path.insert(0, str(current_file_dir / "models"))
+    _use_models_dir()
+
+    # the process may be reused by several runs, with a different number of workers
+    import torch
+    torch.set_num_threads(nbthreads or _default_nbthreads or torch.get_num_threads())
+    if nbthreads:
+        logging.info(f"Using {nbthreads} threads for {'videos' if is_video else 'photos'}")
+
+    # models loaded once when the worker process started, otherwise loaded by the predictor
+    classifier = _shared_models.getClassifier() if _shared_models is not None else None
+    detector = _shared_models.getDetector() if _shared_models is not None else None
+
+    # static frames/images skip the detector with the motion prefilter
+    motionminarea = performance_config.motion_min_area if performance_config.motion_prefilter else None
+    # classification overlapping the detection of the next batch, by default on GPU only
+    pipeline = None if performance_config.pipeline_stages == "auto" else performance_config.pipeline_stages == "on"
+    checkpointer = _Checkpointer(filenames, is_video, threshold, LANG, performance_config, shard)
 
     if is_video:
         logging.info("Loading video predictor...")
         from predictTools import PredictorVideo
-        predictor = PredictorVideo(filenames, threshold, LANG)
+        predictor = PredictorVideo(filenames, threshold, LANG,
+                                   prefetchworkers=performance_config.prefetch_workers,
+                                   prefetchmemory=performance_config.prefetch_memory_mb,
+                                   framesampling=performance_config.frame_sampling,
+                                   classifier=classifier, detector=detector,
+                                   earlyexit=performance_config.video_early_exit, motionminarea=motionminarea,
+                                   cachesize=performance_config.prediction_cache_mb, pipeline=pipeline)
+        predictor.detector.resetTimings() # the detector may be shared by several runs
+        checkpointer.resume(predictor)
         logging.info("Starting video predictions...")
         while True:
             batch, _, _ = predictor.nextBatch()
-            logging.info(f"Making prediction for video {batch} / {len(filenames)}")
+            logging.info(f"Making prediction for video {batch} / {len(filenames)}{shard}")
             if batch == len(filenames):
                 break
+            checkpointer.update(predictor)
         logging.info("Video predictions completed")
+        frames_saved, frames_total = predictor.getFramesSaved()
+        if performance_config.video_early_exit:
+            logging.info(f"Early exit skipped {frames_saved} of {frames_total} video frames{shard}")
     else:
         logging.info("Loading photo predictor...")
         from predictTools import PredictorImage
-        predictor = PredictorImage(filenames, threshold, 10, LANG)
+        predictor = PredictorImage(filenames, threshold, PHOTO_MAXLAG, LANG,
+                                   prefetchworkers=performance_config.prefetch_workers,
+                                   prefetchmemory=performance_config.prefetch_memory_mb,
+                                   classifier=classifier, detector=detector, motionminarea=motionminarea,
+                                   cachesize=performance_config.prediction_cache_mb,
+                                   reduceddecode=performance_config.reduced_decode, pipeline=pipeline, dates=dates)
+        predictor.detector.resetTimings() # the detector may be shared by several runs
+        checkpointer.resume(predictor)
         logging.info("Starting photos predictions...")
         while True:
-            batch, _, _, _, _ = predictor.nextBatch()
-            logging.info(f"Making prediction for photo {batch} / {len(filenames)}")
-            if batch == len(filenames):
+            _, _, k2, _, _ = predictor.nextBatch() # batches hold several photos
+            logging.info(f"Making prediction for photo {k2} / {len(filenames)}{shard}")
+            if k2 >= len(filenames):
                 break
+            checkpointer.update(predictor)
         logging.info("Photo predictions completed")
+    predictor.closeCache()
+    checkpointer.complete()
+    for model, seconds, nb_images in predictor.detector.getTimings():
+        if nb_images > 0:
+            logging.info(f"Detector {model}: {nb_images} {'video frames' if is_video else 'photos'} in {seconds:.1f}s{shard}")
+    if performance_config.motion_prefilter:
+        motion_skipped, motion_checked = predictor.getMotionSkipped()
+        logging.info(f"Motion prefilter skipped the detector on {motion_skipped} of {motion_checked} {'video frames' if is_video else 'photos'}{shard}")
 
     predictions, scores, _, counts = predictor.getPredictions()
     dates_raw = predictor.getDates()
@@ -79,13 +219,270 @@ def _predict_videos_worker(filenames, threshold, timezone, LANG, log_queue, is_v
         logging.info(f"Date conversions completed for photos.")
 
     return {
+        "frames_saved": predictor.getFramesSaved() if is_video else (0, 0),
+        "motion_skipped": predictor.getMotionSkipped(),
+        "filenames": predictor.getFilenames(), # photos are reordered by sequence in the predictor
         "predictions": predictions,
         "scores": scores,
         "dates": dates,
         "counts": counts
     }
 
-def predict_videos(video_filenames, photo_filenames, threshold, timezone, LANG="en"):
+def _nb_workers(performance_config):
+    """
+    Number of worker processes available for a run.
+    """
+    nbcores = os.cpu_count() or 1
+    threads_per_worker = performance_config.threads_per_worker or _hardware_profile().get("threads_per_worker", THREADS_PER_WORKER)
+    return performance_config.workers or max(1, nbcores // threads_per_worker)
+
+def _worker_threads(performance_config):
+    """
+    Threads of each worker process when several workers share the cores, None for a single worker.
+    """
+    nb_workers = _nb_workers(performance_config)
+    return None if nb_workers <= 1 else max(1, (os.cpu_count() or 1) // nb_workers)
+
+def _plan_workers(nb_videos, nb_photos, performance_config):
+    """
+    Chooses the number of video and photo worker processes and the torch threads of each worker.
+    The workers are split between videos and photos proportionally to the number of images to analyse,
+    with at least a full batch of photos per photo worker.
+    """
+    nbcores = os.cpu_count() or 1
+    nb_workers = _nb_workers(performance_config)
+    max_video_workers = nb_videos
+    photo_batch_size = _hardware_profile().get("photo_batch_size", PHOTO_BATCH_SIZE)
+    max_photo_workers = max(1, nb_photos // photo_batch_size) if nb_photos > 0 else 0
+    if nb_videos > 0 and nb_photos > 0:
+        video_load = nb_videos*VIDEO_FRAMES_PER_FILE
+        video_workers = max(1, min(nb_workers-1, round(nb_workers*video_load/(video_load+nb_photos))))
+        photo_workers = max(1, nb_workers-video_workers)
+    else:
+        video_workers = nb_workers if nb_videos > 0 else 0
+        photo_workers = nb_workers if nb_photos > 0 else 0
+    video_workers = min(video_workers, max_video_workers)
+    photo_workers = min(photo_workers, max_photo_workers)
+    total_workers = video_workers + photo_workers
+    # a single worker keeps the torch defaults
+    nbthreads = None if total_workers <= 1 else max(1, nbcores // total_workers)
+    return video_workers, photo_workers, nbthreads
+
+def _shard_videos(video_filenames, nb_shards):
+    """
+    Splits the videos in nb_shards contiguous chunks of similar sizes.
+    """
+    size, remainder = divmod(len(video_filenames), nb_shards)
+    shards = []
+    start = 0
+    for i in range(nb_shards):
+        end = start + size + (1 if i < remainder else 0)
+        shards.append(video_filenames[start:end])
+        start = end
+    return [shard for shard in shards if shard]
+
+def _shard_photos(photo_filenames, nb_shards):
+    """
+    Splits the photos in nb_shards chunks of similar sizes, cut only between two sequences
+    so that the sequence-level corrections of each worker are the same as with a single worker.
+    Sequences never cross directories (see FileManager.findSequences): the photos are cut between directories,
+    without reading them. Only the directories larger than a chunk are cut between their sequences, whose dates
+    are read here once and handed to the workers.
+    :return: list of (photos, dates already read by filename)
+    """
+    if nb_shards <= 1:
+        return [(photo_filenames, {})]
+    directories = {} # in order of first appearance, as in FileManager
+    for filename in photo_filenames:
+        directories.setdefault(os.path.dirname(filename), []).append(filename)
+    target = len(photo_filenames) / nb_shards
+    groups = [] # photos never split between two shards, with their dates if read
+    for filenames in directories.values():
+        if len(filenames) <= target:
+            groups.append((filenames, {}))
+            continue
+        _use_models_dir()
+        from fileManager import FileManager
+        fileManager = FileManager(list(filenames))
+        fileManager.findSequences(PHOTO_MAXLAG)
+        fileManager.reorderBySeqnum()
+        dates = dict(zip(fileManager.getFilenames(), fileManager.getDates()))
+        sequences = {}
+        for filename, num in zip(fileManager.getFilenames(), fileManager.getSeqnums()):
+            sequences.setdefault(num, []).append(filename)
+        groups += [(sequence, {filename: dates[filename] for filename in sequence}) for sequence in sequences.values()]
+    shards = [([], {})]
+    for filenames, dates in groups:
+        if len(shards) < nb_shards and len(shards[-1][0]) >= target:
+            shards.append(([], {}))
+        shards[-1][0].extend(filenames)
+        shards[-1][1].update(dates)
+    return shards
+
+def photos_in_same_sequences(photo_filenames, selected):
+    """
+    Returns the photos of photo_filenames in the same sequences as the selected ones, these included,
+    as found when predicting all of them (see FileManager.findSequences). Sequences never cross directories:
+    only the dates of the directories with both selected and other photos are read.
+    """
+    selected = set(selected)
+    directories = {}
+    for filename in photo_filenames:
+        directories.setdefault(os.path.dirname(filename), []).append(filename)
+    photos = set()
+    for filenames in directories.values():
+        if all(filename in selected for filename in filenames):
+            photos.update(filenames)
+            continue
+        if not any(filename in selected for filename in filenames):
+            continue
+        _use_models_dir()
+        from fileManager import FileManager
+        fileManager = FileManager(list(filenames))
+        fileManager.findSequences(PHOTO_MAXLAG)
+        seqnums = dict(zip(fileManager.getFilenames(), fileManager.getSeqnums()))
+        selectedseqnums = {seqnums[filename] for filename in filenames if filename in selected}
+        photos.update(filename for filename in filenames if seqnums[filename] in selectedseqnums)
+    return photos
+
+def _merge_results(worker_results, filenames):
+    """
+    Concatenates the results of the workers, in the order of filenames.
+    """
+    position = {}
+    for worker_result in worker_results:
+        for k, filename in enumerate(worker_result["filenames"]):
+            position[filename] = (worker_result, k)
+    result = {key: [] for key in RESULT_KEYS}
+    for filename in filenames:
+        worker_result, k = position[filename]
+        for key in RESULT_KEYS:
+            result[key].append(worker_result[key][k])
+    return result
+
+def _worker_context():
+    """
+    Multiprocessing context of the workers loading their own models. As for the shared models (see
+    modelHost.getSharingContext), the workers are never forked from this process, which runs other threads
+    (GUI, log listener, warm-up of the pool): a forked worker could inherit a lock held by one of them.
+    """
+    return multiprocessing.get_context("spawn")
+
+def _executor_args(nb_workers, performance_config, warm_up=False):
+    """
+    :return: arguments of the ProcessPoolExecutor of the workers. If enabled, the models are loaded once here
+    and handed to the workers in shared memory, so that each worker does not add a copy of the weights in memory.
+    This process keeps them for as long as the executor lives, e.g. the warm pool of the GUI.
+    Otherwise, for models on GPU, and for the ONNX backend, each worker loads its own when it starts:
+    ONNX Runtime sessions can neither be sent to spawned processes nor be inherited by forked ones,
+    whose intra-op thread pools would not exist.
+    """
+    if performance_config.share_models:
+        _use_models_dir()
+        import torch
+        from modelHost import getSharingContext
+        context = getSharingContext()
+        if not torch.cuda.is_available() and performance_config.backend == "torch":
+            host = _load_models(performance_config, context=context)
+            return dict(max_workers=nb_workers, mp_context=context, initializer=_init_worker, initargs=(host, warm_up, performance_config))
+    return dict(max_workers=nb_workers, mp_context=_worker_context(), initializer=_init_worker, initargs=(None, warm_up, performance_config))
+
+class PredictionPool:
+    """
+    Worker processes kept alive between runs with the models loaded, so that successive runs
+    do not pay again for importing torch and loading the weights. The processes are started in
+    the background by start() and stopped after performance_config.worker_idle_timeout seconds
+    without a run (0 to stop them after each run).
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.executor = None
+        self.performance_config = None
+        self.idle_timer = None
+        self.busy = False
+
+    def start(self, performance_config):
+        """
+        Starts the worker processes and loads the models in a background thread, without waiting.
+        """
+        def warm_up():
+            try:
+                self.acquire(performance_config)
+                self.release()
+            except Exception as e:
+                logging.warning(f"Could not start the prediction processes in advance: {e}")
+        threading.Thread(target=warm_up, daemon=True).start()
+
+    def acquire(self, performance_config):
+        """
+        :return: the executor of the worker processes, started if needed (waits for them to be ready).
+        """
+        with self.lock:
+            self._cancel_idle_timer()
+            if self.executor is not None and self.performance_config != performance_config:
+                logging.info("Performance settings changed, restarting the prediction processes")
+                self._stop()
+            if self.executor is None:
+                self._start(performance_config)
+            self.busy = True
+            return self.executor
+
+    def release(self, discard=False):
+        """
+        Ends a run. The processes are stopped if discard is set, e.g. after a failure, or when idle for too long.
+        """
+        with self.lock:
+            self.busy = False
+            timeout = self.performance_config.worker_idle_timeout if self.performance_config is not None else 0
+            if discard or timeout <= 0:
+                self._stop()
+            else:
+                self.idle_timer = threading.Timer(timeout, self._on_idle)
+                self.idle_timer.daemon = True
+                self.idle_timer.start()
+
+    def shutdown(self):
+        with self.lock:
+            self._cancel_idle_timer()
+            self._stop()
+
+    def _start(self, performance_config):
+        nb_workers = _nb_workers(performance_config)
+        logging.info(f"Starting {nb_workers} prediction process(es) and loading the models...")
+        self.executor = ProcessPoolExecutor(**_executor_args(nb_workers, performance_config, warm_up=True))
+        self.performance_config = performance_config
+        try:
+            # one task per process, each one returns once its process has loaded the models
+            for future in [self.executor.submit(_worker_ready) for _ in range(nb_workers)]:
+                future.result()
+        except Exception:
+            self._stop()
+            raise
+        logging.info("Prediction processes ready")
+
+    def _stop(self):
+        if self.executor is not None:
+            logging.info("Stopping the prediction processes")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.performance_config = None
+
+    def _cancel_idle_timer(self):
+        if self.idle_timer is not None:
+            self.idle_timer.cancel()
+            self.idle_timer = None
+
+    def _on_idle(self):
+        with self.lock:
+            if not self.busy:
+                self._stop()
+
+def predict_videos(video_filenames, photo_filenames, threshold, timezone, LANG="en", performance_config=None, pool=None):
+    """
+    pool is an optional PredictionPool, whose worker processes are reused instead of starting new ones.
+    """
+    if performance_config is None:
+        performance_config = PerformanceConfig()
     logging.info("Lauching predictors subprocess...")
     manager = Manager()
     log_queue = manager.Queue()
@@ -106,29 +503,46 @@ def predict_videos(video_filenames, photo_filenames, threshold, timezone, LANG="
     listener.start()
 
     try:
-        with ProcessPoolExecutor(max_workers=1) as executor:
-            result = {
-                "predictions": [],
-                "scores": [],
-                "dates": [],
-                "counts": []
-            }
-            if len(video_filenames) > 0:
-                video_future = executor.submit(_predict_videos_worker,
-                                        video_filenames, threshold, timezone, LANG, log_queue, is_video=True)
-                video_result = video_future.result()
-                result["predictions"].extend(video_result["predictions"])
-                result["scores"].extend(video_result["scores"])
-                result["dates"].extend(video_result["dates"])
-                result["counts"].extend(video_result["counts"])
-            if len(photo_filenames) > 0:
-                image_future = executor.submit(_predict_videos_worker,
-                                        photo_filenames, threshold, timezone, LANG, log_queue, is_video=False)
-                image_result = image_future.result()
-                result["predictions"].extend(image_result["predictions"])
-                result["scores"].extend(image_result["scores"])
-                result["dates"].extend(image_result["dates"])
-                result["counts"].extend(image_result["counts"])
+        # videos and photos are split in shards, predicted concurrently by processes sharing the cores
+        video_workers, photo_workers, nbthreads = _plan_workers(len(video_filenames), len(photo_filenames), performance_config)
+        video_shards = _shard_videos(video_filenames, video_workers) if video_workers > 0 else []
+        photo_shards = _shard_photos(photo_filenames, photo_workers) if photo_workers > 0 else []
+        logging.info(f"Using {len(video_shards)} video and {len(photo_shards)} photo worker(s)")
+        if pool is None:
+            executor = ProcessPoolExecutor(**_executor_args(max(1, len(video_shards) + len(photo_shards)), performance_config))
+        else:
+            executor = pool.acquire(performance_config)
+        completed = False
+        try:
+            futures = []
+            for i, shard in enumerate(video_shards):
+                futures.append(executor.submit(_predict_videos_worker,
+                                        shard, threshold, timezone, LANG, log_queue, is_video=True,
+                                        performance_config=performance_config, nbthreads=nbthreads,
+                                        shard=f" (videos part {i+1}/{len(video_shards)})" if len(video_shards) > 1 else ""))
+            for i, (shard, dates) in enumerate(photo_shards):
+                futures.append(executor.submit(_predict_videos_worker,
+                                        shard, threshold, timezone, LANG, log_queue, is_video=False,
+                                        performance_config=performance_config, nbthreads=nbthreads,
+                                        shard=f" (photos part {i+1}/{len(photo_shards)})" if len(photo_shards) > 1 else "",
+                                        dates=dates))
+            # videos first then photos, as the filenames used by the caller
+            worker_results = [future.result() for future in futures]
+            result = _merge_results(worker_results, video_filenames + photo_filenames)
+            completed = True
+            if performance_config.video_early_exit and len(video_shards) > 1:
+                frames_saved = sum(worker_result["frames_saved"][0] for worker_result in worker_results)
+                frames_total = sum(worker_result["frames_saved"][1] for worker_result in worker_results)
+                logging.info(f"Early exit skipped {frames_saved} of {frames_total} video frames in total")
+            if performance_config.motion_prefilter and len(futures) > 1:
+                motion_skipped = sum(worker_result["motion_skipped"][0] for worker_result in worker_results)
+                motion_checked = sum(worker_result["motion_skipped"][1] for worker_result in worker_results)
+                logging.info(f"Motion prefilter skipped the detector on {motion_skipped} of {motion_checked} files/frames in total")
+        finally:
+            if pool is None:
+                executor.shutdown()
+            else:
+                pool.release(discard=not completed)
     finally:
         listener.stop()
 
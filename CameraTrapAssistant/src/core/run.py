@@ -8,15 +8,19 @@ from core.file_operations.exif_gps import add_and_extract_gps, extract_existing_
 from core.file_operations.move_empty_files import moveEmptyVideos, moveUndefinedVideos
 from core.stats.csv_generator import generatePredictorResultsAsCSV
 from core.stats.pdf_generator import generateStatsPDF
-from core.prediction.predict import predict_videos
+from core.prediction.predict import predict_videos, photos_in_same_sequences, PredictionPool
 from core.file_operations.rename_files import rename_videos_with_date_and_info
+from core.file_operations.run_manifest import load_manifest, split_processed, entry_results, save_manifest
 
 # Import project utilities
 sys.path.insert(0, str(Path(__file__).parent.parent))
 from config.options_config import OptionsConfig
+from config.performance_config import PerformanceConfig
 from utils.time_utils.timeOffsetToTimezone import time_offset_to_timezone
 
-def runWithArgs(folder, options_config: OptionsConfig, lat=None, lon=None, csv_path=None):
+def runWithArgs(folder, options_config: OptionsConfig, lat=None, lon=None, csv_path=None, performance_config: PerformanceConfig | None = None, prediction_pool: PredictionPool | None = None):
+    if performance_config is None:
+        performance_config = PerformanceConfig()
     ## VIDEOS FILE
     video_filenames = sorted(
             [str(f) for f in Path(folder).rglob('*.[Aa][Vv][Ii]')] +
@@ -40,20 +44,57 @@ def runWithArgs(folder, options_config: OptionsConfig, lat=None, lon=None, csv_p
 
     if (not filenames):
         raise Exception(f"No video or image files found in folder {folder}")
-    
-    if options_config.add_gps and lat is not None and lon is not None:
-        gps_coordinates, addresses = add_and_extract_gps(filenames, lat, lon, options_config.use_gps_only_for_data)
-    else :
-        gps_coordinates, addresses = extract_existing_gps(filenames, options_config.get_gps_from_each_file)
 
+    # Files unchanged since the last run keep their results, only the others are processed
+    manifest_settings = {"prediction_threshold": options_config.prediction_threshold, "time_offset": options_config.time_offset}
+    manifest_entries = load_manifest(folder, manifest_settings) if options_config.only_new_files else {}
+    processed, new = split_processed(folder, filenames, manifest_entries)
+    if processed:
+        logging.info(f"{len(processed)} files unchanged since the last run, {len(new)} new or changed files to process")
+    new_filenames = [filenames[k] for k in new]
+    # Photos of previous runs in the same sequences as new ones are predicted again (from the cached model outputs),
+    # so that their sequence-level corrections are the same as when predicting all the files. Only their results
+    # are updated, they keep their GPS and name
+    repredicted = []
+    new_photos = [filenames[k] for k in new if k >= len(video_filenames)]
+    if processed and new_photos:
+        insequences = photos_in_same_sequences(photo_filenames, new_photos)
+        repredicted = [k for k in processed if filenames[k] in insequences]
+        if repredicted:
+            logging.info(f"{len(repredicted)} unchanged photos in the same sequences as new ones, to predict again")
+    predicted = sorted(new + repredicted)
+
+    gps_coordinates, addresses = [None]*len(filenames), [None]*len(filenames)
+    if new_filenames:
+        if options_config.add_gps and lat is not None and lon is not None:
+            new_gps_coordinates, new_addresses = add_and_extract_gps(new_filenames, lat, lon, options_config.use_gps_only_for_data)
+        else :
+            new_gps_coordinates, new_addresses = extract_existing_gps(new_filenames, options_config.get_gps_from_each_file)
+        for k, gps, address in zip(new, new_gps_coordinates, new_addresses):
+            gps_coordinates[k], addresses[k] = gps, address
+
+    prediction_results = None
     if options_config.rename_files or options_config.generate_data or options_config.generate_stats or options_config.move_empty or options_config.move_undefined or options_config.combine_with_data:
         timezone: datetime.tzinfo = time_offset_to_timezone(options_config.time_offset)
-        prediction_results = predict_videos(video_filenames, photo_filenames, options_config.prediction_threshold, timezone)
+        prediction_results = {key: [None]*len(filenames) for key in ["predictions", "scores", "dates", "counts"]}
+        for k, entry in processed.items():
+            (prediction_results["predictions"][k], prediction_results["scores"][k], prediction_results["dates"][k],
+             prediction_results["counts"][k], gps_coordinates[k], addresses[k]) = entry_results(entry)
+        if predicted:
+            new_results = predict_videos([filenames[k] for k in predicted if k < len(video_filenames)],
+                                         [filenames[k] for k in predicted if k >= len(video_filenames)],
+                                         options_config.prediction_threshold, timezone, performance_config=performance_config, pool=prediction_pool)
+            for i, k in enumerate(predicted):
+                for key in prediction_results:
+                    prediction_results[key][k] = new_results[key][i]
     else:
         logging.info("No data generation or moving of empty videos selected, skipping prediction step.")
 
     if options_config.rename_files:
-        rename_videos_with_date_and_info(filenames, prediction_results["predictions"], prediction_results["dates"])
+        # files of previous runs are already renamed
+        rename_videos_with_date_and_info(new_filenames, [prediction_results["predictions"][k] for k in new], [prediction_results["dates"][k] for k in new])
+        for k, filename in zip(new, new_filenames):
+            filenames[k] = filename
 
     if options_config.generate_stats:
         generateStatsPDF(folder, "stats", prediction_results, addresses, gps_coordinates[0], csv_path)
@@ -66,3 +107,7 @@ def runWithArgs(folder, options_config: OptionsConfig, lat=None, lon=None, csv_p
 
     if options_config.move_undefined:
         moveUndefinedVideos(folder, filenames, prediction_results["predictions"])
+
+    if prediction_results is not None:
+        # results saved with the final location of the files, for the next run
+        save_manifest(folder, filenames, prediction_results, gps_coordinates, addresses, manifest_settings)
@@ -15,19 +15,20 @@ from utils.resource_manager import get_icon_path
 from gui.utils.donation import show_support_nudge, create_support_link_label
 from config.options_config import OptionsConfig
 from core.run import runWithArgs
+from core.prediction.predict import PredictionPool
 from gui.utils.logging import TkinterLogHandler
-from gui.utils.config import load_checkbox_state, save_checkbox_state, increment_run_count
+from gui.utils.config import load_checkbox_state, save_checkbox_state, increment_run_count, load_performance_config
 from gui.utils.tooltip import CheckWithTooltip, LabelWithTooltip
 from utils.time_utils.timeOffsetToTimezone import convert_to_timezone, time_offset_to_timezone
 
 
 
-def run_in_thread(folder, options_config, lat, lon, csv_path=None):
+def run_in_thread(folder, options_config, lat, lon, csv_path=None, performance_config=None):
     """
     Run the main processing in a background thread.
     """
     try:
-        runWithArgs(folder, options_config, lat, lon, csv_path)
+        runWithArgs(folder, options_config, lat, lon, csv_path, performance_config, prediction_pool)
         messagebox.showinfo("Success", "Execution successful.")
     except Exception as e:
         messagebox.showerror("Error", f"Execution failure : {e}")
@@ -60,7 +61,8 @@ def run():
         get_gps_from_each_file = get_gps_each_var.get(),
         use_gps_only_for_data = use_gps_only_for_data_var.get(),
         combine_with_data= combine_with_data_var.get(),
-        time_offset = time_offset_var.get()
+        time_offset = time_offset_var.get(),
+        only_new_files = only_new_files_var.get()
     )
     save_checkbox_state(options_config)
     lat, lon = None, None
@@ -101,7 +103,8 @@ def run():
             logging.info("No support nudge this time.")
     except Exception as e:
         logging.warning(f"Could not update run_count: {e}")
-    threading.Thread(target=run_in_thread, args=(folder, options_config, lat, lon, csv_path), daemon=True).start()
+    performance_config = load_performance_config()
+    threading.Thread(target=run_in_thread, args=(folder, options_config, lat, lon, csv_path, performance_config), daemon=True).start()
 
 
 def main():
@@ -111,7 +114,9 @@ def main():
     """
     global root, folder, label, log_text
     global data_var, stats_var, move_empty_var, move_undefined_var, rename_var, get_gps_each_var, use_gps_only_for_data_var, threshold_var, combine_with_data_var, time_offset_var
+    global only_new_files_var
     global gps_var, coord_var
+    global prediction_pool
     root = tk.Tk()
     root.title("Camera Trap Assistant")
     root.minsize(240, 120)
@@ -180,6 +185,7 @@ def main():
     use_gps_only_for_data_var = tk.BooleanVar(value=options_config.use_gps_only_for_data)
     combine_with_data_var = tk.BooleanVar(value=options_config.combine_with_data)
     time_offset_var = tk.StringVar(value=options_config.time_offset)
+    only_new_files_var = tk.BooleanVar(value=options_config.only_new_files)
     threshold_var = tk.DoubleVar(value=options_config.prediction_threshold)
 
     # Main options frame
@@ -321,6 +327,13 @@ def main():
         "Generates in the 'data' subfolder a CSV that combines the existing selected CSV data with this run's results.\nAlso generates the combined statistics PDF if the option 'Statistics file' is checked.\nThis is useful if you have previous data from other runs or sources that you want to include in the statistics.\nYou will be prompted to select the CSV file when you click 'Run'.",
         width=320
     ).pack(anchor="w", padx=30, pady=(5, 0))
+    CheckWithTooltip(
+        more_content,
+        "Only process new or changed files",
+        only_new_files_var,
+        "Only predicts the files added or modified since the last run on this folder, the others keep the results saved in the 'data' subfolder.\nThe CSV and statistics files still include all the files, and only the new files are renamed, moved or updated with GPS data.\nAll the files are predicted again if the prediction threshold or the time offset changed.",
+        width=320
+    ).pack(anchor="w", padx=30, pady=(5, 0))
     # Start folded
     more_content.pack_forget()
 
@@ -393,7 +406,14 @@ def main():
     logging.getLogger().addHandler(handler)
     logging.getLogger().setLevel(logging.INFO)
 
+    # Prediction processes load the models while the user picks a folder, and stay loaded between runs
+    prediction_pool = PredictionPool()
+    performance_config = load_performance_config()
+    if performance_config.worker_idle_timeout > 0:
+        prediction_pool.start(performance_config)
+
     root.mainloop()
+    prediction_pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -7,6 +7,7 @@ import sys
 from pathlib import Path
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 from config.options_config import OptionsConfig
+from config.performance_config import PerformanceConfig
 
 def get_config_file_path():
     """
@@ -34,7 +35,8 @@ def load_checkbox_state():
             get_gps_from_each_file = config.getboolean('options', 'get_gps_from_each_file', fallback=False),
             use_gps_only_for_data = config.getboolean('options', 'use_gps_only_for_data', fallback=False),
             combine_with_data= config.getboolean('options', 'combine_with_data', fallback=False),
-            time_offset = config.get('options', 'time_offset', fallback='auto')
+            time_offset = config.get('options', 'time_offset', fallback='auto'),
+            only_new_files = config.getboolean('options', 'only_new_files', fallback=False)
         )
     else:
         state = OptionsConfig(
@@ -48,7 +50,8 @@ def load_checkbox_state():
             get_gps_from_each_file = False,
             use_gps_only_for_data = False,
             combine_with_data= False,
-            time_offset = 'auto'
+            time_offset = 'auto',
+            only_new_files = False
         )
     return state
 
@@ -73,9 +76,40 @@ def save_checkbox_state(newOptionsConfig: OptionsConfig):
     config['options']['use_gps_only_for_data'] = str(newOptionsConfig.use_gps_only_for_data)
     config['options']['combine_with_data'] = str(newOptionsConfig.combine_with_data)
     config['options']['time_offset'] = str(newOptionsConfig.time_offset)
+    config['options']['only_new_files'] = str(newOptionsConfig.only_new_files)
     with open(config_file, 'w') as configfile:
         config.write(configfile)
 
+def load_performance_config():
+    """
+    Loads the performance settings from the [performance] section of the config file.
+    These settings are not exposed in the GUI, missing values fall back to the PerformanceConfig defaults.
+    """
+    config = configparser.ConfigParser()
+    config_file = get_config_file_path()
+    default = PerformanceConfig()
+    if os.path.exists(config_file):
+        config.read(config_file)
+    return PerformanceConfig(
+        workers = config.getint('performance', 'workers', fallback=default.workers),
+        threads_per_worker = config.getint('performance', 'threads_per_worker', fallback=default.threads_per_worker),
+        prefetch_workers = config.getint('performance', 'prefetch_workers', fallback=default.prefetch_workers),
+        prefetch_memory_mb = config.getint('performance', 'prefetch_memory_mb', fallback=default.prefetch_memory_mb),
+        frame_sampling = config.get('performance', 'frame_sampling', fallback=default.frame_sampling),
+        video_early_exit = config.getboolean('performance', 'video_early_exit', fallback=default.video_early_exit),
+        motion_prefilter = config.getboolean('performance', 'motion_prefilter', fallback=default.motion_prefilter),
+        motion_min_area = config.getfloat('performance', 'motion_min_area', fallback=default.motion_min_area),
+        pipeline_stages = config.get('performance', 'pipeline_stages', fallback=default.pipeline_stages),
+        reduced_decode = config.getboolean('performance', 'reduced_decode', fallback=default.reduced_decode),
+        share_models = config.getboolean('performance', 'share_models', fallback=default.share_models),
+        compile_classifier = config.getboolean('performance', 'compile_classifier', fallback=default.compile_classifier),
+        classifier_precision = config.get('performance', 'classifier_precision', fallback=default.classifier_precision),
+        backend = config.get('performance', 'backend', fallback=default.backend),
+        prediction_cache_mb = config.getint('performance', 'prediction_cache_mb', fallback=default.prediction_cache_mb),
+        checkpoint_interval = config.getint('performance', 'checkpoint_interval', fallback=default.checkpoint_interval),
+        worker_idle_timeout = config.getint('performance', 'worker_idle_timeout', fallback=default.worker_idle_timeout)
+    )
+
 def load_map_state():
     """
     Loads the last map coordinates and zoom from the config file. Returns (lat, lon, zoom).
@@ -0,0 +1,174 @@
+"""
+Persistent cache of the detector and classifier outputs, keyed by a fingerprint of the file content
+and an identifier of the models, so that re-running a folder does not repeat the inference.
+"""
+import hashlib
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+PREDICTION_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "deepfaune", "predictions.sqlite")
+PREDICTION_CACHE_MAXSIZE = 1024 # MB on disk, least recently used entries are evicted above
+CACHE_VERSION = 1 # to increase when the cached outputs change, invalidates all the entries
+FINGERPRINT_BYTES = 65536 # bytes hashed at the beginning and at the end of a file
+
+def getFingerprint(filename):
+    """
+    Fast fingerprint of the content of filename, whatever its name or location:
+    its size and the hash of its first and last FINGERPRINT_BYTES
+    :return: hexadecimal fingerprint, None if the file cannot be read
+    """
+    try:
+        with open(filename, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(0)
+            digest = hashlib.blake2b(str(size).encode(), digest_size=16)
+            digest.update(f.read(FINGERPRINT_BYTES))
+            if size>2*FINGERPRINT_BYTES:
+                f.seek(-FINGERPRINT_BYTES, os.SEEK_END)
+            digest.update(f.read(FINGERPRINT_BYTES))
+    except OSError:
+        return None
+    return digest.hexdigest()
+
+def getModelId(*parts):
+    """
+    :param parts: names and settings of the models, and their weights files, fingerprinted by content
+    :return: identifier of the models, None if one of the parts is None (no cache)
+    """
+    if any(part is None for part in parts):
+        return None
+    digest = hashlib.blake2b(str(CACHE_VERSION).encode(), digest_size=16)
+    for part in parts:
+        if isinstance(part, str) and os.path.isfile(part):
+            part = getFingerprint(part)
+        digest.update(repr(part).encode())
+    return digest.hexdigest()
+
+class PredictionCache:
+    """
+    Outputs of the models of identifier modelid for a file fingerprint (see getFingerprint),
+    and optionally a frame position for videos, stored in the sqlite database path.
+    Entries of other models (other weights, or CACHE_VERSION) are never used again: they are kept
+    until evicted as least recently used when the database exceeds maxsize MB (see evict, run by close(evict=True)
+    after the predictions), or removed by clear().
+    get() can be called from the prefetch threads; put() entries are written by flush().
+    """
+    def __init__(self, modelid, path=PREDICTION_CACHE, maxsize=PREDICTION_CACHE_MAXSIZE):
+        self.modelid = modelid
+        self.path = path
+        self.maxbytes = maxsize*1024*1024
+        self.lock = threading.Lock()
+        self.pending = [] # entries to write
+        self.accessed = [] # keys read, to update their access time
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # several prediction processes may use the cache at once
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, model TEXT, value BLOB, "
+                                    "size INTEGER, accessed REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def __key(self, fingerprint, position):
+        return f"{self.modelid}:{fingerprint}" if position is None else f"{self.modelid}:{fingerprint}:{position}"
+
+    def get(self, fingerprint, position=None):
+        """
+        :return: cached outputs, None if not in the cache
+        """
+        if fingerprint is None:
+            return None
+        key = self.__key(fingerprint, position)
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM entries WHERE key=?", (key,)).fetchone()
+            if row is None:
+                return None
+            self.accessed.append(key)
+        return pickle.loads(row[0])
+
+    def put(self, fingerprint, value, position=None):
+        if fingerprint is None:
+            return
+        data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        with self.lock:
+            self.pending.append((self.__key(fingerprint, position), self.modelid, data, len(data)))
+
+    def flush(self):
+        """
+        Writes the new entries and the access times, in a single transaction
+        """
+        with self.lock:
+            if not len(self.pending) and not len(self.accessed):
+                return
+            now = time.time()
+            try:
+                with self.connection:
+                    self.connection.executemany("INSERT OR REPLACE INTO entries VALUES (?,?,?,?,?)",
+                                                [entry+(now,) for entry in self.pending])
+                    self.connection.executemany("UPDATE entries SET accessed=? WHERE key=?", [(now, key) for key in self.accessed])
+            except sqlite3.Error as err:
+                logging.warning(f"Prediction cache not updated: {err}")
+            self.pending = []
+            self.accessed = []
+
+    def evict(self):
+        """
+        Removes the least recently used entries while the cache exceeds its maximal size
+        """
+        with self.lock, self.connection:
+            total = self.connection.execute("SELECT COALESCE(SUM(size),0) FROM entries").fetchone()[0]
+            if total<=self.maxbytes:
+                return
+            excess = total-0.9*self.maxbytes # some room, not to evict at each run
+            removed = 0
+            keys = []
+            cursor = self.connection.execute("SELECT key, size FROM entries ORDER BY accessed")
+            for key, size in cursor:
+                keys.append((key,))
+                removed += size
+                if removed>=excess:
+                    break
+            cursor.close()
+            self.connection.executemany("DELETE FROM entries WHERE key=?", keys)
+        logging.info(f"Prediction cache: {len(keys)} entries evicted")
+
+    def clear(self, olderthan=None):
+        """
+        Removes all the entries, or the ones not used for olderthan days, e.g. the entries of previous weights
+        :return: number of entries removed
+        """
+        with self.lock:
+            with self.connection:
+                if olderthan is None:
+                    removed = self.connection.execute("DELETE FROM entries").rowcount
+                else:
+                    removed = self.connection.execute("DELETE FROM entries WHERE accessed<?", (time.time()-olderthan*86400,)).rowcount
+            self.connection.execute("VACUUM") # giving the space back to the file system
+        return removed
+
+    def getStats(self):
+        """
+        :return: number of entries, size in bytes and last access time, by model identifier
+        """
+        with self.lock:
+            return self.connection.execute("SELECT model, COUNT(*), SUM(size), MAX(accessed) FROM entries GROUP BY model").fetchall()
+
+    def close(self, evict=False):
+        """
+        :param evict: evicts the least recently used entries above maxsize, see evict
+        """
+        if self.connection is None:
+            return
+        self.flush()
+        if evict:
+            try:
+                self.evict()
+            except sqlite3.Error as err:
+                logging.warning(f"Prediction cache not evicted: {err}")
+        self.connection.close()
+        self.connection = None
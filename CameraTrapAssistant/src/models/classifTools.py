@@ -31,20 +31,31 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL license and that you accept its terms.
 
+import json
 import logging
 import sys
 import os
+import warnings
 import numpy as np
 import timm
 import torch
 from torch import tensor
 import torch.nn as nn
+import torch.nn.functional as F
 from torchvision.transforms import InterpolationMode, transforms
+from onnxTools import onnxPath, createSession
+from hardwareProfile import isOutOfMemory, releaseMemory
 
 CROP_SIZE = 182
+CROP_MEAN = [0.4850, 0.4560, 0.4060] # normalization of the RGB crops
+CROP_STD = [0.2290, 0.2240, 0.2250]
 BACKBONE = "vit_large_patch14_dinov2.lvd142m"
 DFPATH = os.path.abspath(os.path.dirname(__file__))
 DFVIT_WEIGHTS = os.path.join(DFPATH, 'weights', 'deepfaune-vit_large_patch14_dinov2.lvd142m.v3.pt')
+COMPILE_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "deepfaune", "torchinductor") # kernels compiled by torch.compile
+PRECISIONS = ["fp32", "bf16", "int8"] # fp32, bf16 autocast, int8 dynamic quantization of the Linear layers
+PRECISION_VALIDATION = os.path.join(os.path.expanduser("~"), ".cache", "deepfaune", "precision_validation.json")
+PRECISION_MIN_AGREEMENT = 0.99 # minimal top-1 agreement with fp32 for a reduced precision to be used
 
 txt_animalclasses = {
     'fr': ['bison', 'blaireau', 'bouquetin', 'castor', 'cerf', 'chamois', 'chat', 'chevre', 'chevreuil', 'chien', 'daim', 'ecureuil', 'elan', 'equide', 'genette', 'glouton', 'herisson', 'lagomorphe', 'loup', 'loutre', 'lynx', 'marmotte', 'micromammifere', 'mouflon', 'mouton', 'mustelide', 'oiseau', 'ours', 'ragondin', 'raton laveur', 'renard', 'renne', 'sanglier', 'vache'],
@@ -59,22 +70,180 @@ txt_animalclasses = {
 ####################################################################################
 class Classifier:
 
-    def __init__(self, device=None):
-        self.model = Model(device)
-        self.model.loadWeights(DFVIT_WEIGHTS)
+    def __init__(self, device=None, compile=False, precision="fp32", weights=DFVIT_WEIGHTS, backend="torch", nbthreads=None):
+        if backend == "onnx" and (weights is None or not os.path.exists(onnxPath(weights))):
+            logging.warning(f"ONNX export of the classifier not found (see tools/export_onnx.py), using torch")
+            backend = "torch"
+        self.backend = backend
+        if backend == "onnx":
+            self.weights = onnxPath(weights) # weights file used, identifying the classifier with its precision
+            self.model = None # the torch model is not loaded
+            self.engine = OnnxEngine(onnxPath(weights), device, nbthreads) # threads of its own ONNX Runtime session
+        else:
+            self.weights = weights
+            self.model = Model(device)
+            if weights is not None: # random weights otherwise, for benchmarks
+                self.model.loadWeights(weights)
+            if precision != "fp32" and not isPrecisionValidated(precision, weights):
+                logging.warning(f"Classifier precision {precision} not validated against fp32 on this machine "
+                                "(see tools/validate_classifier_precision.py), using fp32")
+                precision = "fp32"
+            self.engine = InferenceEngine(self.model, device, compile=compile, precision=precision) # torch threads are set by the caller
         self.transforms = transforms.Compose([
             transforms.Resize(size=(CROP_SIZE, CROP_SIZE), interpolation=InterpolationMode.BICUBIC, max_size=None, antialias=None),
             transforms.ToTensor(),
-            transforms.Normalize(mean=tensor([0.4850, 0.4560, 0.4060]), std=tensor([0.2290, 0.2240, 0.2250]))])
+            transforms.Normalize(mean=tensor(CROP_MEAN), std=tensor(CROP_STD))])
+        self.mean = tensor(CROP_MEAN).view(1,3,1,1)
+        self.std = tensor(CROP_STD).view(1,3,1,1)
 
     def predictOnBatch(self, batchtensor, withsoftmax=True):
-        return self.model.predict(batchtensor, withsoftmax)
+        try:
+            return self.engine.predict(batchtensor, withsoftmax)
+        except Exception as err:
+            if not isOutOfMemory(err) or len(batchtensor) <= 1:
+                raise err
+            # batch too large for the memory of this machine, predicted in two halves
+            logging.warning(f"Out of memory with {len(batchtensor)} crops, classifying them in smaller batches")
+            releaseMemory()
+            half = len(batchtensor)//2
+            return np.concatenate((self.predictOnBatch(batchtensor[:half], withsoftmax),
+                                   self.predictOnBatch(batchtensor[half:], withsoftmax)))
 
     # croppedimage loaded by PIL
     def preprocessImage(self, croppedimage):
         preprocessimage = self.transforms(croppedimage)
         return preprocessimage.unsqueeze(dim=0)
 
+    def preprocessCrops(self, croppedimagecvs, out):
+        """
+        Batched equivalent of preprocessImage for crops in cv2 BGR (numpy views of the decoded images, see cropSquareCV),
+        without PIL: each crop is resized as PIL does (bicubic, antialiased, on uint8) straight into out,
+        a tensor of shape (len(croppedimagecvs),3,CROP_SIZE,CROP_SIZE), then the whole batch is normalized in place.
+        """
+        for k, croppedimagecv in enumerate(croppedimagecvs):
+            imagetensor = torch.from_numpy(croppedimagecv[:,:,:3]).permute(2,0,1).unsqueeze(0) # BGR, view
+            try:
+                resized = F.interpolate(imagetensor, size=(CROP_SIZE,CROP_SIZE), mode="bicubic", antialias=True, align_corners=False)
+            except RuntimeError: # uint8 interpolation not available in this torch version
+                resized = F.interpolate(imagetensor.float(), size=(CROP_SIZE,CROP_SIZE), mode="bicubic", antialias=True, align_corners=False).clamp_(0,255).round_()
+            out[k] = resized[0].flip(0) # to RGB
+        out.div_(255.).sub_(self.mean).div_(self.std)
+        return out
+
+
+####################################################################################
+### INFERENCE ENGINE
+####################################################################################
+class InferenceEngine:
+    """
+    Inference-only runner of a classifier model, set up once instead of at each batch:
+    evaluation mode, device, channels-last layout, precision (see PRECISIONS) and optional
+    compilation (torch.compile, with the compiled kernels cached on disk).
+    The torch threads are shared by all the models of a process: they are set per prediction process
+    (see core/prediction/predict.py), not here.
+    Returns the outputs as a float32 numpy array, without copy on CPU.
+    int8 quantizes the model in place, its fp32 Linear weights are released.
+    """
+    def __init__(self, model, device=None, compile=False, precision="fp32"):
+        self.device = torch.device(device if device is not None else (model.device or "cpu"))
+        self.model = model.eval().to(self.device, memory_format=torch.channels_last)
+        if precision not in PRECISIONS:
+            raise ValueError(f"Unknown classifier precision {precision}, expected one of {PRECISIONS}")
+        if precision == "int8":
+            precision = self.__quantize()
+        self.precision = precision
+        self.forward = self.model
+        self.compiled = False
+        if compile:
+            self.compile()
+
+    def __quantize(self):
+        if self.device.type != "cpu":
+            logging.warning("int8 classifier is only available on CPU, using fp32")
+            return "fp32"
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore") # eager mode quantization is deprecated in recent torch versions
+                torch.ao.quantization.quantize_dynamic(self.model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+        except Exception as e:
+            logging.warning(f"int8 classifier not available ({e}), using fp32")
+            return "fp32"
+        return "int8"
+
+    def compile(self):
+        try:
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", COMPILE_CACHE_DIR)
+            import torch._inductor.config
+            torch._inductor.config.fx_graph_cache = True # compiled graphs reused by the next processes
+            self.forward = torch.compile(self.model)
+            self.compiled = True
+        except Exception as e:
+            logging.warning(f"Classifier compilation not available ({e}), running without")
+
+    def predict(self, data, withsoftmax=True):
+        """
+        :param data: batch tensor of preprocessed images
+        :return: numpy array of predictions, logits if not withsoftmax
+        """
+        x = data.to(self.device).contiguous(memory_format=torch.channels_last)
+        with torch.inference_mode(), torch.autocast(self.device.type, dtype=torch.bfloat16, enabled=self.precision == "bf16"):
+            try:
+                output = self.forward(x)
+            except Exception as e:
+                if not self.compiled:
+                    raise e
+                # compilation happens at the first batch and may fail, e.g. without a C++ compiler
+                logging.warning(f"Classifier compilation failed ({e}), running without")
+                self.forward = self.model
+                self.compiled = False
+                output = self.forward(x)
+            if withsoftmax:
+                output = output.softmax(dim=1)
+        return output.float().cpu().numpy()
+
+class OnnxEngine:
+    """
+    Runner of the classifier exported to ONNX (tools/export_onnx.py) with ONNX Runtime,
+    same interface as InferenceEngine.
+    """
+    def __init__(self, path, device=None, nbthreads=None):
+        self.session = createSession(path, device, nbthreads)
+        self.input = self.session.get_inputs()[0].name
+        self.precision = "fp32"
+
+    def predict(self, data, withsoftmax=True):
+        x = data.numpy() if isinstance(data, torch.Tensor) else data
+        output = self.session.run(None, {self.input: np.ascontiguousarray(x, dtype=np.float32)})[0]
+        if withsoftmax:
+            output = np.exp(output-output.max(axis=1, keepdims=True))
+            output = output/output.sum(axis=1, keepdims=True)
+        return output
+
+def loadPrecisionValidations():
+    """
+    :return: results of tools/validate_classifier_precision.py on this machine, by weights file and precision
+    """
+    try:
+        with open(PRECISION_VALIDATION) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return dict()
+
+def savePrecisionValidation(precision, agreement, meandrift, maxdrift, nbcrops, weights=DFVIT_WEIGHTS):
+    validations = loadPrecisionValidations()
+    validations.setdefault(os.path.basename(weights), dict())[precision] = dict(
+        agreement=agreement, meandrift=meandrift, maxdrift=maxdrift, nbcrops=nbcrops,
+        passed=agreement >= PRECISION_MIN_AGREEMENT)
+    os.makedirs(os.path.dirname(PRECISION_VALIDATION), exist_ok=True)
+    with open(PRECISION_VALIDATION, "w") as f:
+        json.dump(validations, f, indent=2)
+
+def isPrecisionValidated(precision, weights=DFVIT_WEIGHTS):
+    if weights is None:
+        return False
+    validation = loadPrecisionValidations().get(os.path.basename(weights), dict()).get(precision)
+    return validation is not None and validation["passed"]
+
 
 ####################################################################################
 ### MODEL
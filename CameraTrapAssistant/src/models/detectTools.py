@@ -31,8 +31,11 @@
 # The fact that you are presently reading this means that you have had
 # knowledge of the CeCILL license and that you accept its terms.
 
+import inspect
 import logging
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 import numpy as np
 from PIL import Image
@@ -51,6 +54,8 @@ current_dir = Path(__file__).parent
 sys.path.insert(0, str(current_dir))
 
 import warnings
+from onnxTools import onnxPath, createSession
+from hardwareProfile import isOutOfMemory, releaseMemory
 
 DFYOLO_NAME = "DF"
 DFYOLO_WIDTH = 960 # image width
@@ -69,18 +74,49 @@ MDRYOLO_THRES = 0.5
 MDRYOLO_WEIGHTS = os.path.join(DFPATH, 'weights', 'md_v1000.0.0-redwood.pt')
 
 class YOLOEnsemble:
-    def __init__(self, weightA, weightB=None, imgszA=None, imgszB=None, thresA=None, thresB=None, backstop=True):
-        self.yoloA = YOLO(weightA)
-        self.yoloB = None if weightB is None else YOLO(weightB)
+    def __init__(self, weightA, weightB=None, imgszA=None, imgszB=None, thresA=None, thresB=None, backstop=True, concurrent=None):
+        # .pt or .onnx weights, ultralytics runs the latter with ONNX Runtime
+        self.yoloA = YOLO(weightA, task="detect")
+        self.yoloB = None if weightB is None else YOLO(weightB, task="detect")
         self.imgszA = imgszA
         self.imgszB = imgszB
         self.thresA = thresA
         self.thresB = thresB
         self.backstop = backstop
+        # ensemble mode: B runs alongside A, in a thread; by default on GPU only, on CPU both models already use all the threads
+        self.concurrent = concurrent
+        self.timings = {"A": [0., 0], "B": [0., 0]} # seconds and images, by model
+        self.names = {"A": modelName(weightA), "B": None if weightB is None else modelName(weightB)}
 
     def __call__(self, filename_or_imagecv=None, verbose=False, device=None):
+        return self.predictOnBatch([filename_or_imagecv], verbose=verbose, device=device)
+
+    def __predict(self, model, imagecvs, verbose):
+        start = time.perf_counter()
+        if model == "A":
+            results = self.yoloA(imagecvs, verbose=verbose, imgsz=self.imgszA, conf=self.thresA)
+        else:
+            results = self.yoloB(imagecvs, verbose=verbose, imgsz=self.imgszB, conf=self.thresB)
+        self.timings[model][0] += time.perf_counter()-start
+        self.timings[model][1] += len(imagecvs)
+        return results
+
+    def predictOnBatch(self, filenames_or_imagecvs, verbose=False, device=None, boxesonly=False):
+        # one forward pass per model for the whole batch, returns one Results per image,
+        # or with boxesonly an array of boxes xyxy, confidence and class (see MDRedwood.predictOnBatch)
+        # files are decoded once, for both models
+        imagecvs = [imreadCV(f) if isinstance(f, str) else f for f in filenames_or_imagecvs]
+        if any(imagecv is None for imagecv in imagecvs):
+            raise FileNotFoundError
         try:
-            resultsA = self.yoloA(filename_or_imagecv, verbose=verbose, imgsz=self.imgszA, conf=self.thresA)
+            if self.yoloB is not None and not self.backstop and self.__isConcurrent(device):
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    futureB = executor.submit(self.__predict, "B", imagecvs, verbose)
+                    resultsA = self.__predict("A", imagecvs, verbose)
+                    resultsB = futureB.result()
+            else:
+                resultsA = self.__predict("A", imagecvs, verbose)
+                resultsB = None
         except FileNotFoundError:
             raise FileNotFoundError
         except Exception as err:
@@ -88,28 +124,53 @@ class YOLOEnsemble:
             raise err
         # Single model case:
         if self.yoloB is None:
-            return resultsA        
+            return self.__output(resultsA, boxesonly)
         # Two models case:
         # Are there any relevant boxes?
         # Yes. Stop here in backstop mode or continue in ensemble mode
         # No. Continue in both modes
-        detectionA = resultsA[0].cpu().numpy().boxes
-        if len(detectionA.cls) > 0 and self.backstop:
-            return resultsA
-        
-        resultsB = self.yoloB(filename_or_imagecv, verbose=verbose, imgsz=self.imgszB, conf=self.thresB)
-        detectionB = resultsB[0].cpu().numpy().boxes
+        detectionsA = [resultA.cpu().numpy().boxes for resultA in resultsA]
+        rangeB = [k for k in range(len(resultsA)) if not (len(detectionsA[k].cls) > 0 and self.backstop)]
+        if not len(rangeB):
+            return self.__output(resultsA, boxesonly)
+
+        if resultsB is None:
+            # all the images without detection by A, in a single batch for B
+            resultsB = self.__predict("B", [imagecvs[k] for k in rangeB], verbose)
+        for k, resultB in zip(rangeB, resultsB):
+            detectionA = detectionsA[k]
+            detectionB = resultB.cpu().numpy().boxes
+
+            # Concat A (empty in backstop mode) and B
+            boxes = np.concatenate((detectionA.xyxy, detectionB.xyxy))
+            scores = np.concatenate((detectionA.conf, detectionB.conf))
+            classes = np.concatenate((detectionA.cls, detectionB.cls))
+
+            # NMS
+            keep = list(nms(torch.Tensor(boxes), torch.Tensor(scores), iou_threshold=0.5).numpy())
+
+            resultsA[k].update(np.concatenate((boxes, np.expand_dims(scores, 1), np.expand_dims(classes, 1)), axis=1)[keep])
+        return self.__output(resultsA, boxesonly)
+
+    def __output(self, results, boxesonly):
+        if not boxesonly:
+            return results
+        return [np.asarray(result.cpu().numpy().boxes.data) for result in results]
 
-        # Concat A (empty in backstop mode) and B
-        boxes = np.concatenate((detectionA.xyxy, detectionB.xyxy))
-        scores = np.concatenate((detectionA.conf, detectionB.conf))
-        classes = np.concatenate((detectionA.cls, detectionB.cls))
+    def __isConcurrent(self, device):
+        if self.concurrent is not None:
+            return self.concurrent
+        return device is not None and torch.device(device).type == "cuda"
 
-        # NMS
-        keep = list(nms(torch.Tensor(boxes), torch.Tensor(scores), iou_threshold=0.5).numpy())
+    def getTimings(self):
+        """
+        :return: name, seconds and number of images of each model since the last resetTimings()
+        """
+        return [(self.names[model], seconds, nbimages) for model, (seconds, nbimages) in self.timings.items()
+                if self.names[model] is not None]
 
-        resultsA[0].update(np.concatenate((boxes, np.expand_dims(scores, 1), np.expand_dims(classes, 1)), axis=1)[keep])
-        return resultsA
+    def resetTimings(self):
+        self.timings = {"A": [0., 0], "B": [0., 0]}
 
 class MDRedwood:
     IMAGE_SIZE = MDRYOLO_WIDTH  # The class must have an IMAGE_WIDTH attribute
@@ -118,7 +179,16 @@ class MDRedwood:
         self.device = device if device else "cuda" if torch.cuda.is_available() else "cpu"
         self.imgsz = imgsz
         self.thres = thres
-        checkpoint = torch.load(MDRYOLO_WEIGHTS, map_location=device)
+        weight = MDRYOLO_WEIGHTS if weight is None else weight
+        self.name = modelName(weight)
+        self.timings = [0., 0] # seconds and images
+        self.session = None
+        if weight.endswith(".onnx"):
+            self.model = None
+            self.session = createSession(weight, self.device)
+            self.input = self.session.get_inputs()[0].name
+            return
+        checkpoint = loadPickled(weight, device) # pickled yolov5 model
         self.model = checkpoint["model"].float().fuse().eval().to(self.device)
         for m in self.model.modules():
             if isinstance(m, torch.nn.Upsample):
@@ -130,14 +200,34 @@ class MDRedwood:
         return img
     
     def __call__(self, filename_or_imagecv=None, verbose=False, device=None):
+        return self.predictOnBatch([filename_or_imagecv], verbose=verbose, device=device)
+
+    def predictOnBatch(self, filenames_or_imagecvs, verbose=False, device=None, boxesonly=False):
+        # images are letterboxed to the same square size, so they can be stacked in a single tensor,
+        # run in a single forward pass and a single non maximum suppression for the whole batch
+        # boxesonly returns per image an array of boxes xyxy, confidence and class, sorted by decreasing confidence,
+        # instead of Results
+        start = time.perf_counter()
         try:
-            img = cv2.imread(filename_or_imagecv) if isinstance(filename_or_imagecv, str) else filename_or_imagecv
-            imagecv = self.transform(cv2.cvtColor(img, cv2.COLOR_BGR2RGB))
-            preds = self.model(imagecv.unsqueeze(0).to(self.device))[0]
-            preds = torch.cat(non_max_suppression(prediction=preds, conf_thres=self.thres), axis=0)
-            preds[:, :4] = scale_boxes([self.IMAGE_SIZE] * 2, preds[:, :4], img.shape).round()
-            results = [Results(orig_img=img, path="", names={0: "animal", 1: "person", 2: "vehicle"})]
-            results[0].update(preds)
+            imgs = [cv2.imread(f) if isinstance(f, str) else f for f in filenames_or_imagecvs]
+            batchtensor = torch.stack([self.transform(cv2.cvtColor(img, cv2.COLOR_BGR2RGB)) for img in imgs])
+            with torch.no_grad(): # no autograd graph
+                if self.session is not None:
+                    prediction = torch.from_numpy(self.session.run(None, {self.input: batchtensor.numpy()})[0])
+                else:
+                    prediction = self.model(batchtensor.to(self.device))[0]
+                predsbatch = non_max_suppression(prediction=prediction, conf_thres=self.thres)
+            results = []
+            for img, preds in zip(imgs, predsbatch):
+                preds[:, :4] = scale_boxes([self.IMAGE_SIZE] * 2, preds[:, :4], img.shape).round() # clipped to the image
+                if boxesonly:
+                    results.append(preds.cpu().numpy())
+                else:
+                    result = Results(orig_img=img, path="", names={0: "animal", 1: "person", 2: "vehicle"})
+                    result.update(preds)
+                    results.append(result)
+            self.timings[0] += time.perf_counter()-start
+            self.timings[1] += len(imgs)
             return results
         except FileNotFoundError:
             raise FileNotFoundError
@@ -145,42 +235,99 @@ class MDRedwood:
             print(err)
             raise err
 
+    def getTimings(self):
+        """
+        :return: name, seconds and number of images of the model since the last resetTimings()
+        """
+        return [(self.name, self.timings[0], self.timings[1])]
+
+    def resetTimings(self):
+        self.timings = [0., 0]
+
 
 ####################################################################################
 ### BEST BOX DETECTION 
 ####################################################################################
 class Detector:
-    def __init__(self, name=DFYOLO_NAME, device=None):
+    def __init__(self, name=DFYOLO_NAME, device=None, backend="torch"):
         logging.info(f"Using {name} for detection")
         self.device = device
+        self.backend = backend
+        self.weights = [] # weights files used, identifying the detector with its name
         if name not in [DFYOLO_NAME, MDSYOLO_NAME, DFYOLO_NAME+"bs"+MDSYOLO_NAME, DFYOLO_NAME+MDSYOLO_NAME,
                         MDRYOLO_NAME]:
             name = DFYOLO_NAME
             warnings.warn("Detector model "+name+" not found. Using "+DFYOLO_NAME+" instead.")
+        self.name = name
         if name == DFYOLO_NAME:
-            self.yolo = YOLOEnsemble(DFYOLO_WEIGHTS, imgszA=DFYOLO_WIDTH, thresA=DFYOLO_THRES)
+            self.yolo = YOLOEnsemble(self.__weights(DFYOLO_WEIGHTS), imgszA=DFYOLO_WIDTH, thresA=DFYOLO_THRES)
         if name == MDSYOLO_NAME:
-            self.yolo = YOLOEnsemble(MDSYOLO_WEIGHTS, imgszA=MDSYOLO_WIDTH, thresA=MDSYOLO_THRES)
+            self.yolo = YOLOEnsemble(self.__weights(MDSYOLO_WEIGHTS), imgszA=MDSYOLO_WIDTH, thresA=MDSYOLO_THRES)
         if name == DFYOLO_NAME+"bs"+MDSYOLO_NAME: # backstop method
-            self.yolo = YOLOEnsemble(DFYOLO_WEIGHTS, MDSYOLO_WEIGHTS, imgszA=DFYOLO_WIDTH, imgszB=MDSYOLO_WIDTH,
+            self.yolo = YOLOEnsemble(self.__weights(DFYOLO_WEIGHTS), self.__weights(MDSYOLO_WEIGHTS), imgszA=DFYOLO_WIDTH, imgszB=MDSYOLO_WIDTH,
                                      thresA=DFYOLO_THRES, thresB=MDSYOLO_THRES, backstop=True)
         if name == DFYOLO_NAME+MDSYOLO_NAME: # ensemble method
-            self.yolo = YOLOEnsemble(DFYOLO_WEIGHTS, MDSYOLO_WEIGHTS, imgszA=DFYOLO_WIDTH, imgszB=MDSYOLO_WIDTH,
+            self.yolo = YOLOEnsemble(self.__weights(DFYOLO_WEIGHTS), self.__weights(MDSYOLO_WEIGHTS), imgszA=DFYOLO_WIDTH, imgszB=MDSYOLO_WIDTH,
                                      thresA=DFYOLO_THRES, thresB=MDSYOLO_THRES, backstop=False)
         if name == MDRYOLO_NAME:
-            self.yolo = MDRedwood(MDRYOLO_WEIGHTS, MDRYOLO_WIDTH, MDRYOLO_THRES, device=device)
+            self.yolo = MDRedwood(self.__weights(MDRYOLO_WEIGHTS), MDRYOLO_WIDTH, MDRYOLO_THRES, device=device)
+        # input size of the detector, images decoded at a lower resolution would lose details (see imreadReduced)
+        self.width = MDRYOLO_WIDTH if name == MDRYOLO_NAME else max(DFYOLO_WIDTH, MDSYOLO_WIDTH if MDSYOLO_NAME in name else 0)
+
+    def __weights(self, weights):
+        # ONNX export of the weights with the onnx backend (tools/export_onnx.py), if available
+        if self.backend == "onnx":
+            if os.path.exists(onnxPath(weights)):
+                self.weights.append(onnxPath(weights))
+                return onnxPath(weights)
+            logging.warning(f"{onnxPath(weights)} not found (see tools/export_onnx.py), using {os.path.basename(weights)}")
+        self.weights.append(weights)
+        return weights
 
     def bestBoxDetection(self, filename_or_imagecv):
+        return self.bestBoxDetectionOnBatch([filename_or_imagecv])[0]
+
+    def imread(self, filename):
+        return imreadCV(filename)
+
+    def getTimings(self):
+        # per model, e.g. to see the cost of the backstop model
+        return self.yolo.getTimings()
+
+    def resetTimings(self):
+        self.yolo.resetTimings()
+
+    def bestBoxDetectionOnBatch(self, filenames_or_imagecvs, imagecvs=None):
+        # images are decoded here, unless already decoded (imagecvs), and sent together to the detector, in a single forward pass
+        if imagecvs is None:
+            imagecvs = [self.imread(f) if isinstance(f, str) else f for f in filenames_or_imagecvs]
+        detections = [(None, 0, np.zeros(4), 0, []) for _ in imagecvs]
+        rangevalid = [k for k in range(len(imagecvs)) if imagecvs[k] is not None] # missing or corrupted files are empty
+        if not len(rangevalid):
+            return detections
         try:
-            results = self.yolo(filename_or_imagecv, device=self.device)
-        except FileNotFoundError:
-            return None, 0, np.zeros(4), 0, []
+            results = self.yolo.predictOnBatch([imagecvs[k] for k in rangevalid], device=self.device, boxesonly=True)
         except Exception as err:
             print(err)
-            return None, 0, np.zeros(4), 0, []
-        # orig_img a numpy array (cv2) in BGR
-        imagecv = results[0].cpu().orig_img
-        detection = results[0].cpu().numpy().boxes
+            if isOutOfMemory(err):
+                releaseMemory()
+            if len(rangevalid) > 1:
+                # falling back to image by image detection, to isolate the failing image (or when out of memory)
+                for k in rangevalid:
+                    detections[k] = self.bestBoxDetectionOnBatch([imagecvs[k]])[0]
+            return detections
+        for k, boxes in zip(rangevalid, results):
+            imagecv = imagecvs[k]
+            if isinstance(imagecv, ReducedImage): # boxes mapped to the full image, crops taken at full resolution
+                xscale, yscale = imagecv.getScale()
+                boxes = boxes.copy()
+                boxes[:, :4] *= np.array([xscale, yscale, xscale, yscale], dtype=boxes.dtype)
+            detections[k] = self.__bestBoxInResult(imagecv, boxes)
+        return detections
+
+    def __bestBoxInResult(self, imagecv, boxes):
+        # imagecv a numpy array (cv2) in BGR, boxes xyxy, confidence and class sorted by decreasing confidence
+        detection = Detections(boxes)
 
         # Are there any relevant boxes?
         if not len(detection.cls):
@@ -201,7 +348,14 @@ class Detector:
         # Is this an animal box ?
         if category == 1:
             # Yes: cropped image is required for classification
-            croppedimage = cropSquareCVtoPIL(imagecv, box.copy())
+            if isinstance(imagecv, ReducedImage): # decoded at full resolution for the crop only
+                fullcv = imagecv.decodeFull()
+                if fullcv is not None:
+                    croppedimage = cropSquareCV(fullcv, box.copy())
+                else:
+                    croppedimage = cropSquareCV(np.asarray(imagecv), box/np.array(imagecv.getScale()*2, dtype=box.dtype))
+            else:
+                croppedimage = cropSquareCV(imagecv, box.copy())
         else: 
             # No: cropped image is not required for classification 
             croppedimage = None
@@ -224,12 +378,10 @@ class Detector:
 ####################################################################################
 ### BEST BOX DETECTION WITH JSON
 ####################################################################################
-from load_api_results import load_api_results
+from detectionsJSON import loadDetectionsJSON, DetectionsJSON
+from imageTools import LazyImage, ReducedImage, imreadColor
 import json
-import contextlib
 import os
-from pandas import concat
-from numpy import argmax
 import sys
 
 MDV5_THRES = 0.4
@@ -239,49 +391,44 @@ class DetectorJSON:
     We assume JSON categories are 1=animal, 2=person, 3=vehicle and the empty category 0=empty
 
     :param jsonfilename: JSON file containing the bondoing boxes coordinates, such as generated by megadetectorv5
+    :param filename_replacements: path tokens replaced to match local paths, e.g. {'/data/':'/mnt/data/'}
     """
-    def __init__(self, jsonfilename, thres=MDV5_THRES):
-        # getting results in a dataframe
-        with contextlib.redirect_stdout(open(os.devnull, 'w')):
-            try:
-                self.df_json, _ = load_api_results(jsonfilename)
-                # removing lines with Failure event
-                if 'failure' in self.df_json.keys():
-                    self.df_json = self.df_json[self.df_json['failure'].isnull()]
-                    self.df_json.reset_index(drop=True, inplace = True)
-                    self.df_json.drop('failure', axis=1, inplace=True)
-            except json.decoder.JSONDecodeError:
-                self.df_json = []
+    def __init__(self, jsonfilename, thres=MDV5_THRES, filename_replacements=None):
+        # getting results in numpy arrays, streamed from the JSON (without the images with a failure)
+        try:
+            self.detections = loadDetectionsJSON(jsonfilename, filename_replacements=filename_replacements)
+        except json.decoder.JSONDecodeError:
+            self.detections = DetectionsJSON()
         self.thres = thres
         self.k = 0 # current image index
         self.kbox = 0 # current box index
-        self.imagecv = None
+        self.imagecv = None # numpy array (cv2), or LazyImage when only its shape is needed
+        self.shapes = dict() # shape of the images by filename, read from their header or decoded
         self.filenameindex = dict()
         self.setFilenameIndex()
 
-    def bestBoxDetection(self, filename):
+    def bestBoxDetection(self, filename, imagecv=None):
         try:
             self.k = self.filenameindex[filename]
         except KeyError:
             return None, 0, np.zeros(4), 0, []
-        # now reading filename to obtain width/height (required by convertJSONboxToBox)
-        # and possibly crop if it is an animal
-        self.nextImread() 
-        if len(self.df_json['detections'][self.k]): # is non empty
-            # Focus on the most confident bounding box coordinates
-            self.kbox = argmax([box['conf'] for box in self.df_json['detections'][self.k]])
-            if self.df_json['detections'][self.k][self.kbox]['conf']>self.thres:
-                category = int(self.df_json['detections'][self.k][self.kbox]['category'])
-            else:
-                category = 0 # considered as empty
-            count = sum([box['conf']>self.thres for box in self.df_json['detections'][self.k]])
-        else: # is empty
-            category = 0
+        # most confident box, considered as empty below the threshold
+        category = int(self.bestcategory[self.k])
         if category == 0:
             return None, 0, np.zeros(4), 0, []
+        self.kbox = int(self.bestbox[self.k]-self.detections.offsets[self.k])
+        count = int(self.count[self.k])
+        # now reading filename to obtain width/height (required by convertJSONboxToBox)
+        # and possibly crop if it is an animal
+        if imagecv is None:
+            self.nextImread() 
+        else:
+            self.imagecv = imagecv # already read
         # is an animal detected ?
         if category != 1:
             croppedimage = None
+            if self.imagecv is None or self.imagecv.shape is None: # missing or corrupted file
+                return None, 0, np.zeros(4), 0, []
             box = self.convertJSONboxToBox()
         # if yes, cropping the bounding box
         else:
@@ -292,22 +439,29 @@ class DetectorJSON:
         humanboxes = []
         return croppedimage, category, box, count, humanboxes
 
+    def bestBoxDetectionOnBatch(self, filenames, imagecvs=None):
+        # detections are already available in the JSON, no batching is needed
+        if imagecvs is None:
+            imagecvs = [None]*len(filenames)
+        return [self.bestBoxDetection(filename, imagecv) for filename, imagecv in zip(filenames, imagecvs)]
+
     def nextBoxDetection(self):
-        if self.k >= len(self.df_json):
+        if self.k >= len(self.detections):
             raise IndexError # no next box
         # is an animal detected ?
-        if len(self.df_json['detections'][self.k]):
+        if self.detections.nbBoxes(self.k):
             if self.kbox == 0:
                 self.nextImread() 
             # is box above threshold ?
-            if self.df_json['detections'][self.k][self.kbox]['conf']>self.thres:
-                category = int(self.df_json['detections'][self.k][self.kbox]['category'])
+            kbox = self.detections.offsets[self.k]+self.kbox
+            if self.detections.conf[kbox]>self.thres:
+                category = int(self.detections.category[kbox])
                 croppedimage = self.cropCurrentBox()
             else: # considered as empty
                 category = 0
                 croppedimage = None
             self.kbox += 1
-            if self.kbox >= len(self.df_json['detections'][self.k]):
+            if self.kbox >= self.detections.nbBoxes(self.k):
                 self.k += 1
                 self.kbox = 0
         else: # is empty
@@ -318,8 +472,8 @@ class DetectorJSON:
         return croppedimage, category
 
     def convertJSONboxToBox(self):
-        box_norm = self.df_json['detections'][self.k][self.kbox]["bbox"]
-        height, width, _ = self.imagecv.shape 
+        box_norm = self.detections.bbox[self.detections.offsets[self.k]+self.kbox]
+        height, width = self.imagecv.shape[:2] # read from the header of a LazyImage
         xmin = int(box_norm[0] * width)
         ymin = int(box_norm[1] * height)
         xmax = xmin + int(box_norm[2] * width)
@@ -328,42 +482,50 @@ class DetectorJSON:
         return(box)
         
     def cropCurrentBox(self):
+        if isinstance(self.imagecv, LazyImage): # pixels decoded now, for the crop
+            self.imagecv = self.imagecv.decode()
         if self.imagecv is None:
             return None, np.zeros(4)
         box = self.convertJSONboxToBox()
-        croppedimage = cropSquareCVtoPIL(self.imagecv, box)
+        croppedimage = cropSquareCV(self.imagecv, box)
         return croppedimage, box
     
     def setFilenameIndex(self):
-        k = 0
-        for filename in self.getFilenames():
-            self.filenameindex[filename] = k
-            k = k+1
+        self.filenameindex = {filename: k for k, filename in enumerate(self.getFilenames())}
+        # best box, its category and the count of each image, for all the images at once
+        self.bestbox, self.bestcategory, self.count = self.detections.bestBoxes(self.thres)
         
     def getNbFiles(self):
-        return self.df_json.shape[0]
+        return len(self.detections)
     
     def getFilenames(self):
-        return list(self.df_json["file"].to_numpy())
+        return self.detections.getFilenames()
     
     def getCurrentFilename(self):
-        if self.k >= len(self.df_json):
+        if self.k >= len(self.detections):
             raise IndexError
-        return self.df_json['file'][self.k]
+        return self.detections.getFilename(self.k)
     
     def nextImread(self):
-        try:
-            self.imagecv = cv2.imdecode(np.fromfile(str(self.df_json["file"][self.k]), dtype=np.uint8),  cv2.IMREAD_UNCHANGED)
-        except FileNotFoundError as e:
-            print(e, file=sys.stderr)
-            self.imagecv = None
+        self.imagecv = self.imread(self.getCurrentFilename())
+
+    def imread(self, filename):
+        """
+        :return: image decoded (cv2) when its most confident box is an animal, to crop it (None if it cannot be decoded),
+        otherwise a LazyImage reading only its shape from the file header, for the box coordinates
+        """
+        image = LazyImage(filename, self.shapes)
+        k = self.filenameindex.get(filename)
+        if k is not None and self.bestcategory[k] == 1:
+            return image.decode()
+        return image
 
     def resetDetection(self):
         self.k = 0
         self.kbox = 0
     
     def merge(self, detector):
-        self.df_json = concat([self.df_json, detector.df_json], ignore_index=True)
+        self.detections = self.detections.concat(detector.detections)
         self.resetDetection()
         self.setFilenameIndex()
 
@@ -371,10 +533,41 @@ class DetectorJSON:
 ####################################################################################
 ### TOOLS
 ####################################################################################      
+class Detections:
+    '''
+    Columns of an array of boxes xyxy, confidence and class, as in ultralytics Boxes, without building Results
+    '''
+    def __init__(self, boxes):
+        self.xyxy = boxes[:, :4]
+        self.conf = boxes[:, 4]
+        self.cls = boxes[:, 5]
+
 '''
-:return: cropped PIL image, as squared as possible (rectangle if close to the borders)
+:return: name of a model, from its weights file
 '''
-def cropSquareCVtoPIL(imagecv, box):
+def modelName(weights):
+    return os.path.splitext(os.path.basename(str(weights)))[0]
+
+'''
+:return: whole pickled object of a torch file (e.g. a yolov5 checkpoint), which torch>=2.6 only loads with
+weights_only=False, a keyword that torch<1.13 does not have
+'''
+def loadPickled(weights, device):
+    if "weights_only" in inspect.signature(torch.load).parameters:
+        return torch.load(weights, map_location=device, weights_only=False)
+    return torch.load(weights, map_location=device)
+
+'''
+:return: numpy array (cv2) in BGR, or None if the file is missing or cannot be decoded
+'''
+def imreadCV(filename):
+    return imreadColor(filename)
+
+'''
+:return: cropped image, as squared as possible (rectangle if close to the borders),
+as a view of imagecv (cv2 BGR, no copy)
+'''
+def cropSquareCV(imagecv, box):
     x1, y1, x2, y2 = box
     xsize = (x2-x1)
     ysize = (y2-y1)
@@ -386,5 +579,11 @@ def cropSquareCVtoPIL(imagecv, box):
         x2 = x2+int((ysize-xsize)/2)
     height, width, _ = imagecv.shape
     croppedimagecv = imagecv[max(0,int(y1)):min(int(y2),height),max(0,int(x1)):min(int(x2),width)]
-    croppedimage = Image.fromarray(croppedimagecv[:,:,(2,1,0)]) # converted to PIL BGR image
+    return croppedimagecv
+
+'''
+:return: cropped PIL image, as squared as possible (rectangle if close to the borders)
+'''
+def cropSquareCVtoPIL(imagecv, box):
+    croppedimage = Image.fromarray(cropSquareCV(imagecv, box)[:,:,(2,1,0)]) # converted to PIL BGR image
     return croppedimage
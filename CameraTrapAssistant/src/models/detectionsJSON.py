@@ -0,0 +1,201 @@
+"""
+Columnar loading of the detections of a MegaDetector batch output JSON, read as a stream:
+the images are decoded one by one into compact numpy arrays, never the whole file at once.
+"""
+import json
+import os
+import re
+from array import array
+
+import numpy as np
+
+JSON_CHUNK = 1 << 20 # characters read at once
+JSON_FIELDS = ['info', 'detection_categories', 'images'] # fields of a detector output
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+DECODER = json.JSONDecoder()
+
+class JSONStream:
+    """
+    Reads the JSON values of a file one after the other, keeping in memory only the value being decoded
+    """
+    def __init__(self, file):
+        self.file = file
+        self.buffer = ""
+        self.pos = 0
+        self.keys = [] # keys of the object at the top of the file, read so far
+
+    def __fill(self):
+        chunk = self.file.read(JSON_CHUNK)
+        if not chunk:
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """
+        :return: next character that is not a whitespace
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self.__fill():
+                raise json.JSONDecodeError("Unexpected end of file", self.buffer, self.pos)
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise json.JSONDecodeError(f"Expecting '{char}'", self.buffer, self.pos)
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = DECODER.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # value truncated at the end of the buffer, unless the file is complete
+                if not self.__fill():
+                    raise
+                continue
+            # a number at the end of the buffer may continue in the next chunk
+            if end < len(self.buffer) or not self.__fill():
+                self.pos = end
+                return value
+
+    def items(self, streamed):
+        """
+        Key and value of each field of the object at the top of the file, and for the fields streamed,
+        key and element of the list, for each element
+        """
+        self.expect("{")
+        if self.peek() == "}":
+            return
+        while True:
+            key = self.value()
+            self.keys.append(key)
+            self.expect(":")
+            if key in streamed and self.peek() == "[":
+                self.expect("[")
+                if self.peek() != "]":
+                    while True:
+                        yield key, self.value()
+                        if self.peek() != ",":
+                            break
+                        self.expect(",")
+                self.expect("]")
+            else:
+                yield key, self.value()
+            if self.peek() != ",":
+                break
+            self.expect(",")
+        self.expect("}")
+
+class DetectionsJSON:
+    """
+    Detections of the images of a detector output, successful images only:
+    the detections of the image k are bbox[offsets[k]:offsets[k+1]] (normalized xmin, ymin, width, height),
+    with their confidence conf and category (1=animal, 2=person, 3=vehicle).
+    The filenames are stored in names, a single UTF-8 buffer where each one is followed by a NUL byte,
+    the one of the image k being getFilename(k).
+    """
+    def __init__(self, names=b"", offsets=None, bbox=None, conf=None, category=None, fields=None):
+        self.setNames(names)
+        self.offsets = np.zeros(1, dtype=np.int64) if offsets is None else offsets
+        self.bbox = np.zeros((0,4)) if bbox is None else bbox
+        self.conf = np.zeros(0) if conf is None else conf
+        self.category = np.zeros(0, dtype=np.int16) if category is None else category
+        self.fields = dict() if fields is None else fields # fields of the JSON other than the images
+
+    def setNames(self, names):
+        self.names = bytes(names)
+        # start of each filename in names, and the end of the buffer
+        self.nameoffsets = np.concatenate(([0], np.flatnonzero(np.frombuffer(self.names, dtype=np.uint8) == 0)+1))
+
+    def __len__(self):
+        return len(self.nameoffsets)-1
+
+    def getFilename(self, k):
+        return self.names[self.nameoffsets[k]:self.nameoffsets[k+1]-1].decode("utf-8")
+
+    def getFilenames(self):
+        return self.names.decode("utf-8").split("\0")[:-1]
+
+    def nbBoxes(self, k):
+        return int(self.offsets[k+1]-self.offsets[k])
+
+    def bestBoxes(self, thres):
+        """
+        :return: for each image, the index of its most confident box (the first one if several, -1 without box),
+        its category if above thres (0=empty otherwise), and the number of boxes above thres
+        """
+        starts, ends = self.offsets[:-1], self.offsets[1:]
+        nonempty = ends > starts
+        best = np.full(len(self), -1, dtype=np.int64)
+        if len(self.conf):
+            maxconf = np.maximum.reduceat(self.conf, starts[nonempty])
+            ismax = self.conf == np.repeat(maxconf, (ends-starts)[nonempty])
+            kmax = np.flatnonzero(ismax)
+            best[nonempty] = kmax[np.searchsorted(kmax, starts[nonempty])]
+        category = np.zeros(len(self), dtype=np.int16)
+        above = nonempty.copy()
+        above[nonempty] = self.conf[best[nonempty]] > thres
+        category[above] = self.category[best[above]]
+        nbabove = np.concatenate(([0], np.cumsum(self.conf > thres)))
+        count = nbabove[ends]-nbabove[starts]
+        return best, category, count
+
+    def replaceInFilenames(self, filename_replacements):
+        """
+        Replaces some path tokens to match local paths, e.g. {'/data/':'/mnt/data/'}, in all the filenames at once:
+        a token cannot match across two filenames, separated by a NUL byte
+        """
+        names = self.names
+        for string_to_replace, replacement_string in filename_replacements.items():
+            names = names.replace(string_to_replace.encode("utf-8"), replacement_string.encode("utf-8"))
+        self.setNames(names)
+
+    def concat(self, detections):
+        return DetectionsJSON(self.names + detections.names,
+                              np.concatenate((self.offsets, detections.offsets[1:]+self.offsets[-1])),
+                              np.concatenate((self.bbox, detections.bbox)),
+                              np.concatenate((self.conf, detections.conf)),
+                              np.concatenate((self.category, detections.category)),
+                              {**detections.fields, **self.fields})
+
+def loadDetectionsJSON(jsonfilename, normalize_paths=True, filename_replacements=None):
+    """
+    Streams a detector output, as generated by MegaDetector, into a DetectionsJSON.
+    Images with a failure are left out.
+    :param normalize_paths: applies os.path.normpath to the filenames
+    :param filename_replacements: replaces some path tokens to match local paths, see DetectionsJSON.replaceInFilenames
+    """
+    names = bytearray()
+    offsets = array('q', [0])
+    bbox = array('d')
+    conf = array('d')
+    category = array('h')
+    fields = dict()
+    with open(jsonfilename, encoding="utf-8") as f:
+        stream = JSONStream(f)
+        for key, value in stream.items(streamed=["images"]):
+            if key != "images":
+                fields[key] = value
+                continue
+            if value.get('failure') is not None:
+                continue
+            names += (os.path.normpath(value['file']) if normalize_paths else value['file']).encode("utf-8") + b"\0"
+            for detection in value.get('detections') or []:
+                bbox.extend(detection['bbox'])
+                conf.append(detection['conf'])
+                category.append(int(detection['category']))
+            offsets.append(len(conf))
+    for field in JSON_FIELDS:
+        if field not in stream.keys:
+            raise ValueError(f"Missing field {field} in detection results {jsonfilename}")
+    detections = DetectionsJSON(names, np.frombuffer(offsets, dtype=np.int64), np.frombuffer(bbox).reshape(-1,4),
+                                np.frombuffer(conf), np.frombuffer(category, dtype=np.int16), fields)
+    if filename_replacements is not None:
+        detections.replaceInFilenames(filename_replacements)
+    return detections
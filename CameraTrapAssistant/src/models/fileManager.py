@@ -85,15 +85,16 @@ def getDateFromMetadata(filename):
 
 class FileManager:
     
-    def __init__(self, filenames):
+    def __init__(self, filenames, dates=None):
+        # dates: dates already read, by filename
         self.order = getFilesOrder(filenames)
         self.filenames = filenames
         self.seqnum = [1+k for k in range(0,len(self.filenames))]
         self.dates = ['']*len(self.filenames)
-        self.__findDates()
+        self.__findDates(dict() if dates is None else dates)
 
-    def __findDates(self):
-        self.dates = [getDateFromMetadata(file) for file in self.filenames]
+    def __findDates(self, dates):
+        self.dates = [dates[file] if file in dates else getDateFromMetadata(file) for file in self.filenames]
 
     def reorderBySeqnum(self):
         idx = 0
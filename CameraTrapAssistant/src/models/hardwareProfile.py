@@ -0,0 +1,78 @@
+"""
+Per-machine profile of the batch size and torch threads giving the best throughput,
+measured by tools/autotune.py and used by the predictors instead of the default constants.
+"""
+import json
+import logging
+import os
+import platform
+
+import torch
+
+HARDWARE_PROFILE = os.path.join(os.path.expanduser("~"), ".cache", "deepfaune", "hardware_profile.json")
+PROFILE_VERSION = 1 # to increase when the measured settings change
+
+__profile = None # loaded once per process
+
+def getMachineId():
+    """
+    :return: description of the hardware and software the profile was measured on
+    """
+    return {"version": PROFILE_VERSION,
+            "platform": platform.platform(),
+            "processor": platform.processor() or platform.machine(),
+            "cpus": os.cpu_count(),
+            "torch": torch.__version__,
+            "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None}
+
+def loadHardwareProfile():
+    """
+    :return: settings of the profile, e.g. photo_batch_size, threads_per_worker and interop_threads,
+    no setting if there is no profile or if it was measured on another machine (or after an update)
+    """
+    global __profile
+    if __profile is None:
+        __profile = {}
+        try:
+            with open(HARDWARE_PROFILE, encoding="utf-8") as f:
+                profile = json.load(f)
+            if profile.get("machine") == getMachineId():
+                __profile = profile["settings"]
+                logging.info(f"Hardware profile {HARDWARE_PROFILE}: {__profile}")
+            else:
+                logging.info(f"Hardware profile {HARDWARE_PROFILE} measured on another machine, run tools/autotune.py again")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as err:
+            logging.warning(f"Could not read hardware profile {HARDWARE_PROFILE}: {err}")
+    return __profile
+
+def saveHardwareProfile(settings, measures=None, path=HARDWARE_PROFILE):
+    """
+    :param settings: settings used by the predictors
+    :param measures: throughputs measured, kept for information
+    """
+    global __profile
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({"machine": getMachineId(), "settings": settings, "measures": measures or []}, f, indent=1)
+    os.replace(path + ".tmp", path)
+    __profile = None
+
+def isOutOfMemory(err):
+    """
+    :return: True if err is the failure of an allocation, on the GPU or on the CPU
+    """
+    if isinstance(err, MemoryError):
+        return True
+    if hasattr(torch.cuda, "OutOfMemoryError") and isinstance(err, torch.cuda.OutOfMemoryError):
+        return True
+    message = str(err).lower()
+    return isinstance(err, RuntimeError) and ("out of memory" in message or "can't allocate memory" in message)
+
+def releaseMemory():
+    """
+    Gives the cached GPU memory back after an out of memory error, before retrying with smaller batches
+    """
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
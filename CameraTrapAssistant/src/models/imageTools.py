@@ -0,0 +1,163 @@
+"""
+Image files read without decoding all their pixels: their size is read from the header (JPEG, PNG, TIFF),
+the pixels decoded only when needed, and JPEG decoded at a reduced resolution by libjpeg DCT scaling.
+"""
+import struct
+import sys
+
+import cv2
+import numpy as np
+
+HEADER_MAXBYTES = 1 << 20 # JPEG segments (EXIF, thumbnails) skipped before giving up on the header
+
+# JPEG start of frame markers, holding the size of the image
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# cv2 flags decoding a JPEG at 1/2, 1/4 or 1/8 of its resolution, with the DCT scaling of libjpeg
+REDUCED_FLAGS = {8: cv2.IMREAD_REDUCED_COLOR_8, 4: cv2.IMREAD_REDUCED_COLOR_4, 2: cv2.IMREAD_REDUCED_COLOR_2}
+# PNG channels by color type, as decoded by cv2 with IMREAD_UNCHANGED
+PNG_CHANNELS = {0: 1, 2: 3, 3: 3, 4: 2, 6: 4}
+
+def readImageShape(filename):
+    """
+    Shape of an image from the header of its file, as decoded by cv2 with IMREAD_UNCHANGED (no EXIF rotation)
+    :return: height, width, channels, None if the format is not supported or the header cannot be read
+    """
+    try:
+        with open(filename, "rb") as f:
+            start = f.read(8)
+            if start[:2] == b"\xff\xd8":
+                f.seek(2)
+                return _jpegShape(f)
+            if start == b"\x89PNG\r\n\x1a\n":
+                return _pngShape(f)
+            if start[:4] in [b"II*\x00", b"MM\x00*"]:
+                f.seek(0)
+                return _tiffShape(f)
+    except (OSError, IndexError, struct.error): # truncated header
+        pass
+    return None
+
+def _jpegShape(f):
+    while f.tell() < HEADER_MAXBYTES:
+        if f.read(1) != b"\xff":
+            return None
+        marker = f.read(1)[0]
+        while marker == 0xFF: # fill bytes
+            marker = f.read(1)[0]
+        if marker in [0x01, 0xD8] or 0xD0 <= marker <= 0xD7: # markers without segment
+            continue
+        if marker == 0xDA: # start of the compressed data, without size before
+            return None
+        length, = struct.unpack(">H", f.read(2))
+        if marker in JPEG_SOF:
+            _, height, width, channels = struct.unpack(">BHHB", f.read(6))
+            return height, width, channels
+        f.seek(length-2, 1)
+    return None
+
+def _pngShape(f):
+    _, chunk, width, height, _, colortype = struct.unpack(">I4sIIBB", f.read(18))
+    if chunk != b"IHDR" or colortype not in PNG_CHANNELS:
+        return None
+    return height, width, PNG_CHANNELS[colortype]
+
+def _tiffShape(f):
+    endian = "<" if f.read(2) == b"II" else ">"
+    f.seek(4)
+    offset, = struct.unpack(endian+"I", f.read(4))
+    f.seek(offset)
+    nbentries, = struct.unpack(endian+"H", f.read(2))
+    tags = {}
+    for _ in range(nbentries):
+        tag, fieldtype, _, value = struct.unpack(endian+"HHI4s", f.read(12))
+        if tag in [256, 257, 277]: # width, height, samples per pixel
+            tags[tag] = struct.unpack(endian+("H" if fieldtype == 3 else "I"), value[:2 if fieldtype == 3 else 4])[0]
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[257], tags[256], tags.get(277, 1)
+
+class LazyImage:
+    """
+    Image of filename, decoded with cv2 IMREAD_UNCHANGED by decode() only, its shape being read from the header.
+    :param shapes: shapes by filename, shared by the images to reuse them
+    """
+    def __init__(self, filename, shapes=None):
+        self.filename = filename
+        self.shapes = dict() if shapes is None else shapes
+
+    @property
+    def shape(self):
+        shape = self.shapes.get(self.filename)
+        if shape is None:
+            shape = readImageShape(self.filename)
+            if shape is None: # format not supported, decoding the pixels
+                imagecv = self.decode()
+                shape = None if imagecv is None else imagecv.shape
+            self.shapes[self.filename] = shape
+        return shape
+
+    def decode(self):
+        """
+        :return: numpy array (cv2), None if the file cannot be decoded
+        """
+        try:
+            imagecv = cv2.imdecode(np.fromfile(str(self.filename), dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+        except (OSError, cv2.error) as e:
+            print(e, file=sys.stderr)
+            return None
+        if imagecv is not None:
+            self.shapes[self.filename] = imagecv.shape
+        return imagecv
+
+
+class ReducedImage(np.ndarray):
+    """
+    Image (cv2 BGR) decoded at a reduced resolution from filename, whose full resolution shape is fullshape,
+    to map coordinates back to the full image and to decode it at full resolution for crops
+    """
+    def __new__(cls, imagecv, filename, fullshape):
+        image = np.asarray(imagecv).view(cls)
+        image.filename = filename
+        image.fullshape = fullshape
+        return image
+
+    def __array_finalize__(self, obj):
+        self.filename = getattr(obj, "filename", None)
+        self.fullshape = getattr(obj, "fullshape", None)
+
+    def getScale(self):
+        """
+        :return: scales from the coordinates of this image to the ones of the full image, along x and y
+        """
+        return self.fullshape[1]/self.shape[1], self.fullshape[0]/self.shape[0]
+
+    def decodeFull(self):
+        """
+        :return: the image at full resolution (cv2 BGR), None if it cannot be decoded
+        """
+        return imreadColor(self.filename)
+
+def imreadColor(filename, flags=cv2.IMREAD_COLOR):
+    try:
+        return cv2.imdecode(np.fromfile(str(filename), dtype=np.uint8), flags)
+    except (OSError, cv2.error) as e:
+        print(e, file=sys.stderr)
+        return None
+
+def imreadReduced(filename, width):
+    """
+    Decodes a JPEG at the lowest of 1/8, 1/4 or 1/2 of its resolution still at least width pixels wide (longest side),
+    e.g. the input size of a detector, much faster than at full resolution for large images
+    :return: ReducedImage, or numpy array (cv2 BGR) at full resolution if it cannot be reduced, None if it cannot be decoded
+    """
+    shape = readImageShape(filename) if str(filename).lower().endswith((".jpg", ".jpeg")) else None
+    factor = next((factor for factor in REDUCED_FLAGS if shape is not None and max(shape[:2])/factor >= width), None)
+    if factor is None:
+        return imreadColor(filename)
+    imagecv = imreadColor(filename, REDUCED_FLAGS[factor])
+    if imagecv is None:
+        return None
+    height, width = shape[:2]
+    if (imagecv.shape[0] > imagecv.shape[1]) != (height > width): # rotated by cv2 with the EXIF orientation
+        height, width = width, height
+    return ReducedImage(imagecv, filename, (height, width, 3))
@@ -0,0 +1,83 @@
+"""
+Models loaded once and shared with the prediction processes.
+"""
+import logging
+import sys
+import numpy as np
+import torch
+import torch.multiprocessing
+from pathlib import Path
+
+# Add models directory to path
+current_dir = Path(__file__).parent
+sys.path.insert(0, str(current_dir))
+
+from detectTools import Detector, YOLOEnsemble, MDRedwood, DFYOLO_NAME
+from classifTools import Classifier, CROP_SIZE
+
+def getSharingContext():
+    """
+    :return: multiprocessing context for the prediction processes. They are not forked from the calling process,
+    which may run other threads (GUI, log listener): they are spawned on every platform and receive the weights
+    as shared-memory tensors (torch.multiprocessing reductions). A fork server cannot be used, it sends at most
+    256 file descriptors to a new process, one per tensor of the models.
+    """
+    return torch.multiprocessing.get_context("spawn")
+
+class ModelHost:
+    """
+    Loads the classifier and detector weights once, so that they stay resident for all the jobs of a process
+    and, on CPU, so that adding a prediction process does not add another copy of the weights in memory.
+    context is the multiprocessing context used to hand the models to the prediction processes,
+    None if they are only used by the current process. compile and precision are the classifier inference settings,
+    backend is "torch" or "onnx" (exported models run by ONNX Runtime, with nbthreads threads).
+    Models handed to other processes are compiled by each of them, see setUpProcess, and the int8 classifier
+    is not shared: its quantized weights are not tensors that can be moved to shared memory.
+    """
+    def __init__(self, detectorname=DFYOLO_NAME, device="cpu", context=None, compile=False, precision="fp32", backend="torch", nbthreads=None):
+        if device == "auto":
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.device = torch.device(device)
+        logging.info("Loading models...")
+        # a compiled module cannot be sent to another process, nor be used by it
+        self.classifier = Classifier(self.device, compile=compile and context is None, precision=precision, backend=backend, nbthreads=nbthreads)
+        self.compile = compile and context is not None
+        self.detectorname = detectorname
+        self.detector = Detector(name=detectorname, device=self.device, backend=backend)
+        if context is not None and context.get_start_method() != "fork":
+            # forked processes share the pages already, spawned ones need the tensors in shared memory
+            for module in self.getModules():
+                module.share_memory()
+            if getattr(self.classifier.engine, "precision", None) == "int8":
+                logging.warning("The int8 classifier cannot be shared, each prediction process holds its own copy of its weights")
+
+    def setUpProcess(self):
+        """
+        Finishes setting up the models in a process they were handed to: the classifier is compiled there.
+        """
+        if self.compile:
+            self.classifier.engine.compile()
+            self.compile = False
+
+    def warmUp(self):
+        """
+        Runs the models once on blank inputs, so that their lazy initializations are done before the first files.
+        """
+        self.detector.bestBoxDetectionOnBatch([np.zeros((CROP_SIZE,CROP_SIZE,3), dtype=np.uint8)])
+        self.classifier.predictOnBatch(torch.zeros((1,3,CROP_SIZE,CROP_SIZE)))
+
+    def getModules(self):
+        modules = [self.classifier.model]
+        yolo = self.detector.yolo
+        if isinstance(yolo, YOLOEnsemble):
+            modules += [yolo.yoloA.model] + ([] if yolo.yoloB is None else [yolo.yoloB.model])
+        if isinstance(yolo, MDRedwood):
+            modules += [yolo.model]
+        # models run by ONNX Runtime are not torch modules
+        return [module for module in modules if isinstance(module, torch.nn.Module)]
+
+    def getClassifier(self):
+        return self.classifier
+
+    def getDetector(self, detectorname=DFYOLO_NAME):
+        return self.detector if detectorname == self.detectorname else None
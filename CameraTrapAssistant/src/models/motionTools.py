@@ -0,0 +1,44 @@
+"""
+Motion prefilter: images of a group sharing the same background (frames of a video, images of a sequence)
+that do not change against it are likely empty, and can skip the detector.
+"""
+import cv2
+import numpy as np
+
+MOTION_WIDTH = 64 # thumbnail width, images are compared at this resolution
+MOTION_BLUR = 5 # gaussian kernel applied to the thumbnails, against noise and compression artifacts
+MOTION_PIXEL_THRES = 20 # change of a pixel against the background, in the 0-255 intensity range
+MOTION_MIN_AREA = 0.002 # fraction of changed pixels under which an image is static, the lower the more conservative
+MOTION_MIN_GROUP = 3 # smaller groups are always sent to the detector, their background is not reliable
+
+def getThumbnail(imagecv):
+    """
+    :return: small blurred grayscale version of imagecv (cv2 BGR) used to estimate motion, None if imagecv is None
+    """
+    if imagecv is None:
+        return None
+    gray = cv2.cvtColor(imagecv, cv2.COLOR_BGR2GRAY) if imagecv.ndim==3 else imagecv
+    height = max(1, round(gray.shape[0]*MOTION_WIDTH/gray.shape[1]))
+    thumbnail = cv2.resize(gray, (MOTION_WIDTH, height), interpolation=cv2.INTER_AREA)
+    return cv2.GaussianBlur(thumbnail, (MOTION_BLUR, MOTION_BLUR), 0)
+
+def getStaticMask(thumbnails, minarea=MOTION_MIN_AREA):
+    """
+    The background is the pixelwise median of the thumbnails, after removing their mean intensity
+    so that global lighting changes (sun, clouds, infrared switch) are not seen as motion.
+    The most changing image is never static, so that animals standing still in the whole group are still detected.
+    :param thumbnails: thumbnails of a group of images (see getThumbnail), None for unreadable images
+    :return: boolean array, True for the images without significant change against the background
+    """
+    static = np.zeros(len(thumbnails), dtype=bool)
+    rangevalid = [k for k in range(len(thumbnails)) if thumbnails[k] is not None]
+    if len(rangevalid)<MOTION_MIN_GROUP or len(set(thumbnails[k].shape for k in rangevalid))>1:
+        return static
+    stack = np.stack([thumbnails[k] for k in rangevalid]).astype(np.float32)
+    stack -= stack.mean(axis=(1,2), keepdims=True)
+    background = np.median(stack, axis=0)
+    changed = (np.abs(stack-background)>MOTION_PIXEL_THRES).mean(axis=(1,2))
+    staticvalid = changed<minarea
+    staticvalid[np.argmax(changed)] = False
+    static[rangevalid] = staticvalid
+    return static
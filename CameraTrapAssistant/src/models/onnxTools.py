@@ -0,0 +1,25 @@
+"""
+ONNX Runtime sessions for the models exported to ONNX (see tools/export_onnx.py).
+"""
+import os
+
+BACKENDS = ["torch", "onnx"] # inference backend of the detector and the classifier
+
+def onnxPath(weights):
+    """
+    :return: path of the ONNX export of weights, next to it
+    """
+    return os.path.splitext(weights)[0]+".onnx"
+
+def createSession(path, device=None, nbthreads=None):
+    """
+    :return: ONNX Runtime session for the model in path, on GPU if device is cuda and ONNX Runtime supports it
+    """
+    import onnxruntime as ort # optional dependency, only needed by the onnx backend
+    options = ort.SessionOptions()
+    if nbthreads:
+        options.intra_op_num_threads = nbthreads
+    providers = ["CPUExecutionProvider"]
+    if device is not None and str(device).startswith("cuda") and "CUDAExecutionProvider" in ort.get_available_providers():
+        providers.insert(0, "CUDAExecutionProvider")
+    return ort.InferenceSession(path, options, providers=providers)
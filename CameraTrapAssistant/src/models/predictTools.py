@@ -32,11 +32,15 @@
 # knowledge of the CeCILL license and that you accept its terms.
 
 import logging
+import sqlite3
+import time
 import cv2
 import torch
 import numpy as np
 import pandas as pd
 from abc import ABC, abstractmethod
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait
 import sys
 import os
 from pathlib import Path
@@ -48,6 +52,12 @@ sys.path.insert(0, str(current_dir))
 from detectTools import Detector, DetectorJSON, DFYOLO_NAME
 from classifTools import txt_animalclasses, CROP_SIZE, Classifier
 from fileManager import FileManager
+from prefetchTools import Prefetcher, PREFETCH_WORKERS, PREFETCH_MAXMEMORY
+from videoTools import getFramePositions, getFramePriority, readFramePositions, FRAME_SAMPLING
+from motionTools import getThumbnail, getStaticMask
+from cacheTools import PredictionCache, getFingerprint, getModelId
+from hardwareProfile import loadHardwareProfile
+from imageTools import imreadReduced
 
 txt_classes = {'fr': txt_animalclasses['fr']+["humain","vehicule"],
                'en': txt_animalclasses['en']+["human","vehicle"],
@@ -60,21 +70,84 @@ txt_undefined = {'fr':"indéfini", 'en':"undefined", 'it':"indeterminato", 'de':
 
 DEFAULTLOGIT = 15. # arbitrary default logit value, used for classes human/vehicule/empty
 
+PHOTO_BATCH_SIZE = 8 # images per batch, unless measured by tools/autotune.py on this machine
+
+CROPQUEUE_MAXFILES = 64 # images detected at most before classifying their animal crops, even if not a full batch
+CROPQUEUE_MAXLATENCY = 2. # seconds of detection at most before classifying the animal crops
+PIPELINE_DEPTH = 2 # batches detected ahead of the one returned, when detection and classification overlap
+
+EARLYEXIT_MINFRAMES = 4 # video frames always analysed with early exit
+EARLYEXIT_STEP = 4 # video frames added at each step while the decision is not stable
+EARLYEXIT_MARGIN = 0.1 # score above the threshold for an animal decision to be stable
+
+####################################################################################
+### CROP QUEUE
+####################################################################################
+class CropQueue:
+    """
+    Animal crops of several images or videos, preprocessed as they are detected and classified together
+    once they fill a batch of batchsize crops, their logits being scattered back to their rows of predictions.
+    The crops are preprocessed straight into a single tensor, allocated at the first crops for a whole batch
+    and only grown when the last detections overflow it.
+    """
+    def __init__(self, classifier, batchsize):
+        self.classifier = classifier
+        self.batchsize = batchsize
+        self.tensor = None
+        self.nbcrops = 0
+        self.targets = [] # (predictions, rows) of the crops put together
+
+    def __len__(self):
+        return self.nbcrops
+
+    def isFull(self):
+        return len(self)>=self.batchsize
+
+    def put(self, croppedimages, prediction, rows):
+        """
+        :param croppedimages: crops (cv2 BGR) whose logits are for prediction[rows]
+        """
+        if not len(croppedimages):
+            return
+        nbcrops = self.nbcrops+len(croppedimages)
+        if self.tensor is None:
+            self.tensor = torch.empty((max(self.batchsize, nbcrops),3,CROP_SIZE,CROP_SIZE))
+        elif nbcrops>len(self.tensor):
+            tensor = torch.empty((max(2*len(self.tensor), nbcrops),3,CROP_SIZE,CROP_SIZE))
+            tensor[:self.nbcrops] = self.tensor[:self.nbcrops]
+            self.tensor = tensor
+        self.classifier.preprocessCrops(croppedimages, self.tensor[self.nbcrops:nbcrops])
+        self.nbcrops = nbcrops
+        self.targets.append((prediction, list(rows)))
+
+    def classify(self):
+        if not self.nbcrops:
+            return
+        logits = self.classifier.predictOnBatch(self.tensor[:self.nbcrops], withsoftmax=False)
+        k = 0
+        for prediction, rows in self.targets:
+            prediction[rows,0:logits.shape[1]] = logits[k:k+len(rows)]
+            k += len(rows)
+        self.nbcrops = 0
+        self.targets = []
+
 ####################################################################################
 ### PREDICTOR BASE
 ####################################################################################
 class PredictorBase(ABC):
-    def __init__(self, filenames, threshold, LANG, BATCH_SIZE=8, device=None):
+    def __init__(self, filenames, threshold, LANG, BATCH_SIZE=None, device=None,
+                 prefetchworkers=PREFETCH_WORKERS, prefetchmemory=PREFETCH_MAXMEMORY, classifier=None, dates=None):
         if device in [None, "auto"]:
             self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         if device in ["cpu", "cuda"]:
             self.device = torch.device(device)
         logging.info(f"Use device: {self.device}")
         self.LANG = LANG
+        if BATCH_SIZE is None: # from the hardware profile of this machine, if any
+            BATCH_SIZE = loadHardwareProfile().get("photo_batch_size", PHOTO_BATCH_SIZE)
         self.BATCH_SIZE = BATCH_SIZE
-        self.fileManager = FileManager(filenames)
-        self.classifier = Classifier(self.device)
-        self.cropped_data = torch.ones((self.BATCH_SIZE,3,CROP_SIZE,CROP_SIZE))
+        self.fileManager = FileManager(filenames, dates) # dates already read, by filename
+        self.classifier = Classifier(self.device) if classifier is None else classifier # preloaded classifier, shared between processes
         self.nbclasses = len(txt_classes[self.LANG])
         self.idxhuman = len(txt_animalclasses[self.LANG]) # idx of 'human' class in prediction
         self.idxvehicle = self.idxhuman+1 # idx of 'vehicle' class in prediction
@@ -88,6 +161,19 @@ class PredictorBase(ABC):
         self.count = [0]*self.fileManager.nbFiles()
         self.humancount = [0]*self.fileManager.nbFiles()
         self.threshold = threshold # classification step
+        self.prefetchworkers = prefetchworkers # files read ahead in background threads
+        self.prefetchmemory = prefetchmemory # MB
+        self.prefetcher = None
+        self.motionminarea = None # motion prefilter, see motionTools, disabled by default
+        self.thumbnails = dict() # thumbnails of the current group of images for the motion prefilter
+        self.nbmotionskipped = 0 # images or frames not sent to the detector by the motion prefilter
+        self.nbmotionchecked = 0 # images or frames checked by the motion prefilter
+        self.cache = None # persistent cache of the model outputs, see openCache
+        self.reduceddecode = False # photos decoded near the detector input size, see imageTools.imreadReduced
+        self.framesampling = None # strategy to read the video frames, see videoTools
+        self.pipeline = False # detection of the next batch overlapping the classification of the current one, see nextStage
+        self.stages = deque() # batches detected, whose crops are being classified
+        self.classifyexecutor = None
         self.resetBatch()
 
     
@@ -95,12 +181,163 @@ class PredictorBase(ABC):
         self.k1 = 0 # batch start
         self.k2 = min(self.k1+self.BATCH_SIZE,self.fileManager.nbFiles()) # batch end
         self.batch = 1 # batch num
-        
+        self.resetPrefetch()
+        self.resetStages()
+
+    def staticImages(self, keys, imagecvs, groupkeys):
+        """
+        Motion prefilter of the images imagecvs of keys, against the background of the images of groupkeys,
+        whose thumbnails are kept while the group is processed
+        :return: images to send to the detector, None for the static ones (considered as empty)
+        """
+        if self.motionminarea is None:
+            return imagecvs
+        self.thumbnails = {key:self.thumbnails[key] for key in groupkeys if key in self.thumbnails}
+        for key, imagecv in zip(keys, imagecvs):
+            self.thumbnails[key] = getThumbnail(imagecv)
+        groupkeys = [key for key in groupkeys if key in self.thumbnails]
+        static = dict(zip(groupkeys, getStaticMask([self.thumbnails[key] for key in groupkeys], self.motionminarea)))
+        self.nbmotionchecked += sum(imagecv is not None for imagecv in imagecvs)
+        self.nbmotionskipped += int(sum(static[key] for key in keys))
+        return [None if static[key] else imagecv for key, imagecv in zip(keys, imagecvs)]
+
+    def openCache(self, cachesize):
+        """
+        Opens the persistent cache of the outputs of self.detector and self.classifier (see cacheTools), if cachesize MB>0
+        """
+        if cachesize<=0:
+            return
+        modelid = self.getModelId()
+        if modelid is None: # random weights
+            return
+        try:
+            self.cache = PredictionCache(modelid, maxsize=cachesize)
+        except (OSError, sqlite3.Error) as err:
+            logging.warning(f"Prediction cache not available: {err}")
+
+    def getModelId(self):
+        """
+        :return: identifier of the models, by the content of their weights, and of the settings changing their outputs
+        (see cacheTools.getModelId), None with random weights
+        """
+        # static images with the motion prefilter are cached as empty, for the same motion settings only,
+        # and video frames for the same reading strategy, seeking and grabbing may not return the same frame
+        return getModelId(self.detector.name, self.detector.backend, *self.detector.weights,
+                          self.classifier.weights, self.classifier.backend, self.classifier.engine.precision,
+                          ("motion", self.motionminarea), ("reduced", self.reduceddecode), ("sampling", self.framesampling))
+
+    def closeCache(self):
+        if self.cache is not None:
+            self.cache.close(evict=True) # within the size set by the caller
+            self.cache = None
+
+    def cacheOutputs(self, fingerprint, detection, logits, position=None):
+        """
+        Caches the detection (without the cropped image) and the classifier logits of an image or a frame at position
+        """
+        _, category, box, count, humanboxes = detection
+        self.cache.put(fingerprint, (category, box, count, humanboxes, logits.copy() if category == 1 else None), position)
+
+    def getMotionSkipped(self):
+        """
+        :return: number of images or frames not sent to the detector by the motion prefilter, number checked
+        """
+        return self.nbmotionskipped, self.nbmotionchecked
+
+    def getCheckpoint(self):
+        """
+        :return: state of the predictions of the files before the current batch, to resume with restoreCheckpoint.
+        The logits are kept, so that the sequence at the junction with the next batch is corrected again on resume.
+        """
+        if len(self.stages): # batches detected ahead are predicted again on resume
+            k1, detectionstate = self.stages[0][1], self.stages[0][-1]
+        else:
+            k1, detectionstate = self.k1, self.getDetectionState()
+        return dict(k1=k1, batch=self.batch, filenames=self.fileManager.getFilenames()[:k1],
+                    prediction=self.prediction[:k1].copy(), bestboxes=self.bestboxes[:k1].copy(),
+                    count=self.count[:k1], humancount=self.humancount[:k1],
+                    predictedclass=self.predictedclass[:k1], predictedscore=self.predictedscore[:k1],
+                    predictedtop1=self.predictedtop1[:k1], **detectionstate)
+
+    def getDetectionState(self):
+        """
+        :return: state of the detection of the files so far (motion prefilter), saved in the checkpoints
+        """
+        return dict(thumbnails=dict(self.thumbnails), nbmotionskipped=self.nbmotionskipped, nbmotionchecked=self.nbmotionchecked)
+
+    def restoreCheckpoint(self, checkpoint):
+        """
+        Restores a state of getCheckpoint, the next batch starts after the files already predicted
+        :return: False if the checkpoint does not match the files of the predictor
+        """
+        k1 = checkpoint["k1"]
+        if checkpoint["filenames"] != self.fileManager.getFilenames()[:k1]:
+            return False
+        self.prediction[:k1] = checkpoint["prediction"]
+        self.bestboxes[:k1] = checkpoint["bestboxes"]
+        for name in ["count", "humancount", "predictedclass", "predictedscore", "predictedtop1"]:
+            getattr(self, name)[:k1] = checkpoint[name]
+        self.thumbnails = checkpoint["thumbnails"]
+        self.nbmotionskipped, self.nbmotionchecked = checkpoint["nbmotionskipped"], checkpoint["nbmotionchecked"]
+        self.resetBatch()
+        self.k1 = k1
+        self.batch = checkpoint["batch"]
+        return True
+
+    def resetPrefetch(self):
+        # read-ahead is started at the next batch, once the files and the detector are known
+        if self.prefetcher is not None:
+            self.prefetcher.close()
+        self.prefetcher = None
+
+    def resetStages(self):
+        # batches being classified are dropped, once they do not write in the predictions anymore
+        wait([future for future, *_ in self.stages if future is not None])
+        self.stages.clear()
+
+    def nextStage(self):
+        """
+        Detects the next batches and returns the first one once classified. With self.pipeline, the crops are classified
+        in a background thread while the main thread detects the following batches, PIPELINE_DEPTH batches ahead,
+        so that the detector and the classifier run at the same time.
+        :return: the stage of the batch, as returned by detectStage, without the future of its classification
+        """
+        while self.k1<self.fileManager.nbFiles() and len(self.stages)<(PIPELINE_DEPTH if self.pipeline else 1):
+            detectionstate = self.getDetectionState() # before the batch, for the checkpoints
+            self.stages.append((*self.detectStage(), detectionstate))
+        future, *stage, _ = self.stages.popleft()
+        if future is not None:
+            future.result()
+        if self.k1>=self.fileManager.nbFiles() and not len(self.stages) and self.classifyexecutor is not None:
+            self.classifyexecutor.shutdown()
+            self.classifyexecutor = None
+        return stage
+
+    def classifyStage(self, crops):
+        """
+        Classifies the crops of a batch, in the background thread of the classifier with self.pipeline
+        :return: future of the classification, None if already done
+        """
+        if not self.pipeline:
+            crops.classify()
+            return None
+        if self.classifyexecutor is None:
+            self.classifyexecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="classify")
+        return self.classifyexecutor.submit(crops.classify)
+
     def allBatch(self):
         self.resetBatch()
-        while self.k1<self.fileManager.nbFiles():
+        while self.k1<self.fileManager.nbFiles() or len(self.stages):
             self.nextBatch()
 
+    @abstractmethod
+    def detectStage(self):
+        """
+        Detects the files of the next batch from self.k1, moving self.k1 and self.k2 after them, and starts classifying their crops
+        :return: future of the classification (see classifyStage), range of the files and what is needed to finish the batch
+        """
+        pass
+
     @abstractmethod
     def nextBatch(self):
         pass
@@ -209,45 +446,138 @@ class PredictorBase(ABC):
 ####################################################################################
 class PredictorImageBase(PredictorBase):
     @abstractmethod
-    def __init__(self, filenames, threshold, maxlag, LANG, BATCH_SIZE=8, device=None):
-        PredictorBase.__init__(self, filenames, threshold, LANG, BATCH_SIZE, device=device) # inherits all
+    def __init__(self, filenames, threshold, maxlag, LANG, BATCH_SIZE=None, device=None,
+                 prefetchworkers=PREFETCH_WORKERS, prefetchmemory=PREFETCH_MAXMEMORY, classifier=None, dates=None):
+        PredictorBase.__init__(self, filenames, threshold, LANG, BATCH_SIZE, device=device,
+                               prefetchworkers=prefetchworkers, prefetchmemory=prefetchmemory, classifier=classifier,
+                               dates=dates) # inherits all
         self.fileManager.findSequences(maxlag)
         self.fileManager.reorderBySeqnum()
         self.detector = None
 
     def nextBatch(self):
-        if self.k1>=self.fileManager.nbFiles():
+        """
+        Predicts the next stage of photos, up to CROPQUEUE_MAXFILES of them, as a single batch:
+        batch counts these calls and not BATCH_SIZE photos, the progress being given by k2_batch
+        :return: batch num, range of the photos predicted and range of the photos corrected by their sequences
+        """
+        if self.k1>=self.fileManager.nbFiles() and not len(self.stages):
             return self.batch, self.k1, self.k2, self.k1, self.k2
         else:
-            rangeanimal = []
-            for k in range(self.k1,self.k2):
-                croppedimage, category, box, count, humanboxes = self.detector.bestBoxDetection(self.fileManager.getFilename(k))
-                self.bestboxes[k] = box
-                self.count[k] = count
-                if category > 0: # not empty
-                    self.prediction[k,-1] = 0.
-                if category == 1: # animal
-                    self.cropped_data[k-self.k1,:,:,:] =  self.classifier.preprocessImage(croppedimage)
-                    rangeanimal.append(k)
-                if category == 2: # human
-                    self.prediction[k,self.idxhuman] = DEFAULTLOGIT
-                if category == 3: # vehicle
-                    self.prediction[k,self.idxvehicle] = DEFAULTLOGIT
-                if len(humanboxes): # humans
-                    self.humanboxes[self.fileManager.getFilename(k)] = humanboxes
-                    self.humancount[k] = len(humanboxes)
-            if len(rangeanimal): # predicting species in images with animal 
-                self.prediction[rangeanimal,0:len(txt_animalclasses[self.LANG])] = self.classifier.predictOnBatch(self.cropped_data[[k-self.k1 for k in rangeanimal],:,:,:], withsoftmax=False)
-            k1_batch = self.k1
-            k2_batch = self.k2
+            k1_batch, k2_batch, tocache = self.nextStage()
+            if self.cache is not None: # once classified
+                for fingerprints, detections, rangedetected in tocache:
+                    for k in rangedetected:
+                        self.cacheOutputs(fingerprints[k], detections[k], self.prediction[k,0:len(txt_animalclasses[self.LANG])])
+                self.cache.flush()
+            # all the images of the stage, as a single batch, the detection being ahead with the pipeline
+            k1, k2 = self.k1, self.k2
+            self.k1, self.k2 = k1_batch, k2_batch
             k1seq_batch, k2seq_batch = self.correctPredictionsInSequenceBatch()
-            # switching to next batch
-            self.k1 = self.k2
-            self.k2 = min(self.k1+self.BATCH_SIZE,self.fileManager.nbFiles())
+            self.k1, self.k2 = k1, k2
             self.batch = self.batch+1
             # returning batch results
             return self.batch-1, k1_batch, k2_batch, k1seq_batch, k2seq_batch
 
+    def detectStage(self):
+        """
+        Detects batches of images until their animal crops fill a batch of the classifier, and starts classifying them
+        :return: future of the classification, range of the images, their outputs to cache once classified
+        """
+        if self.prefetcher is None:
+            # images are decoded in background threads, a couple of batches ahead
+            self.prefetcher = Prefetcher(self.fileManager.getFilenames(), self.readImage, depth=2*self.BATCH_SIZE,
+                                         nbworkers=self.prefetchworkers, maxmemory=self.prefetchmemory)
+        k1_batch = self.k1
+        crops = CropQueue(self.classifier, self.BATCH_SIZE)
+        tocache = []
+        start = time.perf_counter()
+        while True:
+            outputs = self.__detectBatch(crops)
+            if self.cache is not None:
+                tocache.append(outputs)
+            self.k1 = self.k2
+            self.k2 = min(self.k1+self.BATCH_SIZE,self.fileManager.nbFiles())
+            if crops.isFull() or self.k1>=self.fileManager.nbFiles() or self.k1-k1_batch>=CROPQUEUE_MAXFILES \
+               or time.perf_counter()-start>CROPQUEUE_MAXLATENCY:
+                break
+        return self.classifyStage(crops), k1_batch, self.k1, tocache
+
+    def __detectBatch(self, crops):
+        """
+        Detects the images of the current batch, or uses their cached outputs, and puts their animal crops in crops
+        :return: fingerprints, detections and indices of the images to cache once classified
+        """
+        fingerprints, cached, imagecvs = map(list, zip(*[self.prefetcher.get(k) for k in range(self.k1,self.k2)]))
+        rangedetected = [k for k in range(self.k1,self.k2) if imagecvs[k-self.k1] is not None] # neither cached nor unreadable
+        if self.motionminarea is not None:
+            # static images of a sequence, against the images of the sequence read so far, are not detected
+            seqnum = self.fileManager.getSeqnums()
+            for num in sorted(set(seqnum[self.k1:self.k2])):
+                rangeseq = [k for k in range(self.k1,self.k2) if seqnum[k]==num]
+                k1seq = rangeseq[0]
+                while (k1seq-1)>=0 and seqnum[(k1seq-1)]==num: # sequence started in a previous batch
+                    k1seq = k1seq-1
+                staticcvs = self.staticImages(rangeseq, [imagecvs[k-self.k1] for k in rangeseq], range(k1seq,rangeseq[-1]+1))
+                for k, imagecv in zip(rangeseq, staticcvs):
+                    imagecvs[k-self.k1] = imagecv
+        # detecting in all images of the batch at once
+        detections = self.detector.bestBoxDetectionOnBatch([self.fileManager.getFilename(k) for k in range(self.k1,self.k2)], imagecvs)
+        rangeanimal = []
+        croppedimages = []
+        for k in range(self.k1,self.k2):
+            if cached[k-self.k1] is not None: # outputs of a previous run
+                category, box, count, humanboxes, logits = cached[k-self.k1]
+            else:
+                croppedimage, category, box, count, humanboxes = detections[k-self.k1]
+            self.bestboxes[k] = box
+            self.count[k] = count
+            if category > 0: # not empty
+                self.prediction[k,-1] = 0.
+            if category == 1 and cached[k-self.k1] is not None: # animal, already classified
+                self.prediction[k,0:len(txt_animalclasses[self.LANG])] = logits
+            elif category == 1: # animal
+                croppedimages.append(croppedimage)
+                rangeanimal.append(k)
+            if category == 2: # human
+                self.prediction[k,self.idxhuman] = DEFAULTLOGIT
+            if category == 3: # vehicle
+                self.prediction[k,self.idxvehicle] = DEFAULTLOGIT
+            if len(humanboxes): # humans
+                self.humanboxes[self.fileManager.getFilename(k)] = humanboxes
+                self.humancount[k] = len(humanboxes)
+        # species predicted with the crops of the next batches, in the order of rangeanimal
+        crops.put(croppedimages, self.prediction, rangeanimal)
+        return dict(zip(range(self.k1,self.k2), fingerprints)), dict(zip(range(self.k1,self.k2), detections)), rangedetected
+
+    def readImage(self, filename):
+        """
+        Reads an image, unless its model outputs are in the cache
+        :return: fingerprint of the file (None without cache), cached outputs (None if not cached), image (cv2 BGR, None if cached)
+        """
+        if self.cache is None:
+            return None, None, self.imread(filename)
+        fingerprint = getFingerprint(filename)
+        cached = self.cache.get(fingerprint)
+        return fingerprint, cached, self.imread(filename) if cached is None else None
+
+    def imread(self, filename):
+        if self.reduceddecode:
+            return imreadReduced(filename, self.detector.width)
+        return self.detector.imread(filename)
+
+    def getCheckpoint(self):
+        checkpoint = PredictorBase.getCheckpoint(self)
+        checkpoint["humanboxes"] = {filename:self.humanboxes[filename] for filename in checkpoint["filenames"] if filename in self.humanboxes}
+        return checkpoint
+
+    def restoreCheckpoint(self, checkpoint):
+        if not PredictorBase.restoreCheckpoint(self, checkpoint):
+            return False
+        self.k2 = min(self.k1+self.BATCH_SIZE,self.fileManager.nbFiles())
+        self.humanboxes.update(checkpoint["humanboxes"])
+        return True
+
     def getPredictionsBase(self, k=None):
         if k is not None:
             return self._PredictorBase__score2class(self.prediction[k,]), self.bestboxes[k,], self.count[k]
@@ -320,19 +650,30 @@ class PredictorImageBase(PredictorBase):
 ####################################################################################
 class PredictorImage(PredictorImageBase):
     ## Predictor performing detections with a detector, from filenames
-    def __init__(self, filenames, threshold, maxlag, LANG, BATCH_SIZE=8, detectorname=DFYOLO_NAME, device=None):
-        PredictorImageBase.__init__(self, filenames, threshold, maxlag, LANG, BATCH_SIZE, device=device) # inherits all
-        self.detector = Detector(name=detectorname, device=self.device)
+    def __init__(self, filenames, threshold, maxlag, LANG, BATCH_SIZE=None, detectorname=DFYOLO_NAME, device=None,
+                 prefetchworkers=PREFETCH_WORKERS, prefetchmemory=PREFETCH_MAXMEMORY, classifier=None, detector=None,
+                 motionminarea=None, cachesize=0, reduceddecode=False, pipeline=None, dates=None):
+        PredictorImageBase.__init__(self, filenames, threshold, maxlag, LANG, BATCH_SIZE, device=device,
+                                    prefetchworkers=prefetchworkers, prefetchmemory=prefetchmemory, classifier=classifier,
+                                    dates=dates) # inherits all
+        self.detector = Detector(name=detectorname, device=self.device) if detector is None else detector
         self.humanboxes = dict()
+        self.motionminarea = motionminarea # static images of a sequence are not detected, see motionTools
+        self.reduceddecode = reduceddecode # large JPEG decoded near the detector input size
+        self.pipeline = self.device.type == "cuda" if pipeline is None else pipeline # by default on GPU, where the models do not share the cores
+        self.openCache(cachesize) # MB, 0 to predict every file again
 
 ####################################################################################
 ### PREDICTOR JSON
 ####################################################################################
 class PredictorJSON(PredictorImageBase):
     ## Predictor using MDv5 detections, listed in jsonfilename
-    def __init__(self, jsonfilename, threshold, maxlag, LANG, BATCH_SIZE=8):
-        detectorjson = DetectorJSON(jsonfilename)
-        PredictorImageBase.__init__(self, detectorjson.getFilenames(), threshold, maxlag, LANG, BATCH_SIZE) # inherits all
+    def __init__(self, jsonfilename, threshold, maxlag, LANG, BATCH_SIZE=None,
+                 prefetchworkers=PREFETCH_WORKERS, prefetchmemory=PREFETCH_MAXMEMORY, classifier=None,
+                 filename_replacements=None):
+        detectorjson = DetectorJSON(jsonfilename, filename_replacements=filename_replacements)
+        PredictorImageBase.__init__(self, detectorjson.getFilenames(), threshold, maxlag, LANG, BATCH_SIZE,
+                                    prefetchworkers=prefetchworkers, prefetchmemory=prefetchmemory, classifier=classifier) # inherits all
         self.detector = detectorjson
         self.humanboxes = dict()
 
@@ -340,99 +681,267 @@ class PredictorJSON(PredictorImageBase):
 ### PREDICTOR VIDEO 
 ####################################################################################
 class PredictorVideo(PredictorBase):
-    def __init__(self, filenames, threshold, LANG, BATCH_SIZE=12, detectorname=DFYOLO_NAME, device=None):
-         PredictorBase.__init__(self, filenames, threshold, LANG, BATCH_SIZE, device=device) # inherits all
+    def __init__(self, filenames, threshold, LANG, BATCH_SIZE=12, detectorname=DFYOLO_NAME, device=None,
+                 prefetchworkers=PREFETCH_WORKERS, prefetchmemory=PREFETCH_MAXMEMORY, framesampling=FRAME_SAMPLING,
+                 classifier=None, detector=None, earlyexit=False, motionminarea=None, cachesize=0, pipeline=None):
+         PredictorBase.__init__(self, filenames, threshold, LANG, BATCH_SIZE, device=device,
+                                prefetchworkers=prefetchworkers, prefetchmemory=prefetchmemory, classifier=classifier) # inherits all
          self.keyframes = [0]*self.fileManager.nbFiles()
-         self.detector = Detector(name=detectorname, device=self.device)
+         self.detector = Detector(name=detectorname, device=self.device) if detector is None else detector
          self.humancount = [0]*self.fileManager.nbFiles()
+         self.framesampling = framesampling # strategy to read the frames, see videoTools
+         self.earlyexit = earlyexit # stopping once the decision is stable, instead of analysing all the frames
+         self.nbframestotal = 0 # frames to analyse in the videos so far
+         self.nbframessaved = 0 # frames not analysed thanks to early exit
+         self.motionminarea = motionminarea # static frames of a video are not detected, see motionTools
+         self.pipeline = self.device.type == "cuda" if pipeline is None else pipeline # by default on GPU, where the models do not share the cores
+         self.openCache(cachesize) # MB, 0 to predict every video again
 
     def resetBatch(self):
         self.k1 = 0
         self.k2 = 1
         self.batch = 1
-    
+        self.resetPrefetch()
+        self.resetStages()
+
+    def readFrames(self, filename, rangeframe=None, videocap=None):
+        """
+        Reads the frames to analyse in a video, or only the ones of indices rangeframe
+        (by default all of them, or the first ones in priority order with early exit).
+        Frames whose model outputs are in the cache are not read.
+        With early exit, the capture videocap of the video is kept open to read its next frames, from where it is.
+        :return: frame positions, indices of the frames successfully read or cached, these frames (cv2 BGR, None if cached),
+        fingerprint of the file (None without cache), cached outputs of these frames (None if not cached),
+        capture of the video kept open (None if released)
+        """
+        if videocap is None:
+            videocap = cv2.VideoCapture(filename)
+        total_frames = int(videocap.get(cv2.CAP_PROP_FRAME_COUNT))
+        kframetotal = []
+        rangeread = []
+        frames = []
+        fingerprint = None
+        cached = dict()
+        if total_frames==0:
+            pass # corrupted video, considered as empty
+        else:
+            fps = int(videocap.get(5))
+            kframetotal = getFramePositions(total_frames, fps, self.BATCH_SIZE)
+            if rangeframe is None:
+                rangeframe = getFramePriority(len(kframetotal))[:EARLYEXIT_MINFRAMES] if self.earlyexit else range(len(kframetotal))
+            rangeframe = sorted(rangeframe)
+            if self.cache is not None:
+                fingerprint = getFingerprint(filename)
+                cached = {k:self.cache.get(fingerprint, kframetotal[k]) for k in rangeframe}
+                cached = {k:outputs for k, outputs in cached.items() if outputs is not None}
+                rangeframe = [k for k in rangeframe if k not in cached]
+            rangeread, frames = readFramePositions(videocap, [kframetotal[k] for k in rangeframe], strategy=self.framesampling)
+            rangeread = [rangeframe[k] for k in rangeread]
+        if not self.earlyexit or len(kframetotal)<=EARLYEXIT_MINFRAMES:
+            videocap.release()
+            videocap = None
+        # cached frames merged with the frames read, in increasing order
+        frames = dict(zip(rangeread, frames))
+        rangeread = sorted(rangeread+list(cached))
+        return kframetotal, rangeread, [frames.get(k) for k in rangeread], fingerprint, [cached.get(k) for k in rangeread], videocap
+
     def nextBatch(self):
-        if self.k1>=self.fileManager.nbFiles():
+        if self.k1>=self.fileManager.nbFiles() and not len(self.stages):
             return self.batch, self.k1, self.k1
-        else:   
-            rangeanimal = []
-            rangenonempty = []
-            predictionallframe = np.zeros(shape=(self.BATCH_SIZE, self.nbclasses+1), dtype=np.float32) # nbclasses+empty
-            predictionallframe[:,-1] = DEFAULTLOGIT # by default, predicted as empty
-            bestboxesallframe = np.zeros(shape=(self.BATCH_SIZE, 4), dtype=np.float32)
-            maxcount = 0            
-            videocap = cv2.VideoCapture(self.fileManager.getFilename(self.k1))
-            total_frames = int(videocap.get(cv2.CAP_PROP_FRAME_COUNT))
-            kframetotal = []
-            if total_frames==0:
-                pass # corrupted video, considered as empty
-            else:
-                fps = int(videocap.get(5))
-                # lag between two successive frames,
-                # first 2/3*BATCH_SIZE spaced with a small lag for the video beginning
-                # next 1/3*BATCH_SIZE spaced with a large lag for the remaining video
-                nbframebegin = int(self.BATCH_SIZE*2/3+0.5)
-                nbframeremain = self.BATCH_SIZE-nbframebegin 
-                lagbegin = int(fps/3)
-                while((nbframebegin-1)*lagbegin>total_frames):
-                    lagbegin = lagbegin-1 # reducing lagbegin if video duration is small
-                kframebegin = [k*lagbegin for k in range(0,nbframebegin)]
-                lagremain = int( (total_frames-kframebegin[-1])/nbframeremain )
-                if lagremain>0:
-                    kframeremain = [kframebegin[-1]+(k+1)*lagremain for k in range(0,nbframeremain)]
-                else:
-                    kframeremain = []
-                kframetotal = kframebegin+kframeremain
-                k = 0 # frame k in position kframe
-                for kframe in kframetotal: 
-                    videocap.set(cv2.CAP_PROP_POS_FRAMES, kframe)
-                    ret,frame = videocap.read()
-                    if ret == False:
-                        pass # Corrupted or unavailable image, considered as empty
-                    else:
-                        imagecv = frame
-                        croppedimage, category, box, count, humanboxes = self.detector.bestBoxDetection(imagecv)
-                        bestboxesallframe[k] = box
-                        if count>maxcount:
-                            maxcount = count
-                        if category > 0: # not empty
-                            rangenonempty.append(k)
-                            predictionallframe[k,-1] = 0.
-                        if category == 1: # animal
-                            self.cropped_data[k,:,:,:] =  self.classifier.preprocessImage(croppedimage)
-                            rangeanimal.append(k)
-                        if category == 2: # human
-                            predictionallframe[k,self.idxhuman] = DEFAULTLOGIT
-                        if category == 3: # vehicle
-                            predictionallframe[k,self.idxvehicle] = DEFAULTLOGIT
-                        if len(humanboxes): # humans in at least one frame
-                            self.humancount[self.k1] = max(self.humancount[self.k1],len(humanboxes))
-                    k = k+1
-            videocap.release()
-            if len(rangeanimal): # predicting species in frames with animal 
-                predictionallframe[rangeanimal,0:len(txt_animalclasses[self.LANG])] = self.classifier.predictOnBatch(self.cropped_data[[k for k in rangeanimal],:,:,:], withsoftmax=False)
-            # Now averaging over the sequence, with priority to animal predictions
-            self.predictedclass[self.k1], self.predictedscore[self.k1], self.predictedtop1[self.k1] = self._PredictorBase__averageLogitInSequence(predictionallframe)
-            if len(rangenonempty): # selecting key frame to display when not empty
-                self.prediction[self.k1,-1] = 0.
-                # using max score
-                if self.predictedclass[self.k1] == txt_classes[self.LANG][self.idxhuman]: # human
-                    kmax = np.argmax(predictionallframe[rangenonempty,self.idxhuman])
-                else:
-                    if self.predictedclass[self.k1] == txt_classes[self.LANG][self.idxvehicle]: # vehicle
-                        kmax = np.argmax(predictionallframe[rangenonempty,self.idxvehicle])
-                    else: # animal
-                        predictionallframeanimal = predictionallframe[rangenonempty,0:len(txt_animalclasses[self.LANG])]
-                        kmax = np.unravel_index(np.argmax(predictionallframeanimal , axis=None), predictionallframeanimal.shape)[0]
-                self.keyframes[self.k1] = kframetotal[rangenonempty[kmax]]
-                self.bestboxes[self.k1] = bestboxesallframe[rangenonempty[kmax]]
-            self.count[self.k1] = maxcount
-            k1_batch = self.k1
-            k2_batch = self.k2
+        else:
+            k1_batch, k2_batch, tocache, videos = self.nextStage()
+            self.__cacheFrames(tocache)
+            for k, video in zip(range(k1_batch,k2_batch), videos):
+                self.__decideVideo(k, *video)
+            self.batch = self.batch+k2_batch-k1_batch # one batch per video
+            return self.batch-1, k1_batch, k2_batch
+
+    def detectStage(self):
+        """
+        Detects videos until their animal crops fill a batch of the classifier, and starts classifying them,
+        one video at a time with early exit, its decision depending on the frames classified so far
+        :return: future of the classification, range of the videos, outputs to cache once classified, outputs of each video
+        """
+        if self.prefetcher is None:
+            # videos are decoded in background threads, a couple of videos ahead
+            self.prefetcher = Prefetcher(self.fileManager.getFilenames(), self.readFrames, depth=2,
+                                         nbworkers=self.prefetchworkers, maxmemory=self.prefetchmemory)
+        k1_batch = self.k1
+        crops = CropQueue(self.classifier, self.BATCH_SIZE)
+        tocache = []
+        videos = []
+        start = time.perf_counter()
+        while True:
+            videos.append(self.__detectVideo(crops, tocache))
             self.k1 = self.k2
             self.k2 = min(self.k1+1,self.fileManager.nbFiles())
-            self.batch = self.batch+1  
-            return self.batch-1, k1_batch, k2_batch
+            if self.earlyexit or crops.isFull() or self.k1>=self.fileManager.nbFiles() or self.k1-k1_batch>=CROPQUEUE_MAXFILES \
+               or time.perf_counter()-start>CROPQUEUE_MAXLATENCY:
+                break
+        return self.classifyStage(crops), k1_batch, self.k1, tocache, videos
+
+    def __detectVideo(self, crops, tocache):
+        """
+        Detects the frames of the video self.k1, putting their animal crops in crops
+        (classified right away with early exit, to decide when to stop)
+        :return: predictions and best boxes of all the frames, frame positions, indices of the non empty frames, max animal count
+        """
+        predictionallframe = np.zeros(shape=(self.BATCH_SIZE, self.nbclasses+1), dtype=np.float32) # nbclasses+empty
+        predictionallframe[:,-1] = DEFAULTLOGIT # by default, predicted as empty
+        bestboxesallframe = np.zeros(shape=(self.BATCH_SIZE, 4), dtype=np.float32)
+        kframetotal, rangeframe, frames, fingerprint, cached, videocap = self.prefetcher.get(self.k1)
+        self.thumbnails = dict() # new background for the motion prefilter
+        rangenonempty, maxcount = self.__predictFrames(rangeframe, frames, cached, predictionallframe, bestboxesallframe,
+                                                       rangeframe, fingerprint, kframetotal, crops, tocache)
+        if self.earlyexit:
+            crops.classify()
+            # next frames in priority order, until the decision is stable
+            priority = getFramePriority(len(kframetotal))
+            rangeread = list(rangeframe)
+            nbframes = min(EARLYEXIT_MINFRAMES, len(kframetotal))
+            decision = None
+            while nbframes<len(kframetotal):
+                decision, stable = self.__stableDecision(predictionallframe, rangeread, decision)
+                if stable:
+                    break
+                # same capture for all the steps, not opened and decoded again from the beginning of the video
+                _, rangeframe, frames, fingerprint, cached, _ = self.readFrames(self.fileManager.getFilename(self.k1), priority[nbframes:nbframes+EARLYEXIT_STEP], videocap)
+                rangenonemptystep, maxcountstep = self.__predictFrames(rangeframe, frames, cached, predictionallframe, bestboxesallframe,
+                                                                       rangeread+rangeframe, fingerprint, kframetotal, crops, tocache)
+                crops.classify()
+                rangeread += rangeframe
+                rangenonempty = sorted(rangenonempty+rangenonemptystep)
+                maxcount = max(maxcount, maxcountstep)
+                nbframes = nbframes+EARLYEXIT_STEP
+            self.nbframessaved += max(0, len(kframetotal)-nbframes)
+            if videocap is not None:
+                videocap.release()
+        self.nbframestotal += len(kframetotal)
+        return predictionallframe, bestboxesallframe, kframetotal, rangenonempty, maxcount
+
+    def __decideVideo(self, k, predictionallframe, bestboxesallframe, kframetotal, rangenonempty, maxcount):
+        """
+        Prediction, key frame and count of the video k, from the predictions of its frames once classified
+        """
+        # Now averaging over the sequence, with priority to animal predictions
+        self.predictedclass[k], self.predictedscore[k], self.predictedtop1[k] = self._PredictorBase__averageLogitInSequence(predictionallframe)
+        if len(rangenonempty): # selecting key frame to display when not empty
+            self.prediction[k,-1] = 0.
+            # using max score
+            if self.predictedclass[k] == txt_classes[self.LANG][self.idxhuman]: # human
+                kmax = np.argmax(predictionallframe[rangenonempty,self.idxhuman])
+            else:
+                if self.predictedclass[k] == txt_classes[self.LANG][self.idxvehicle]: # vehicle
+                    kmax = np.argmax(predictionallframe[rangenonempty,self.idxvehicle])
+                else: # animal
+                    predictionallframeanimal = predictionallframe[rangenonempty,0:len(txt_animalclasses[self.LANG])]
+                    kmax = np.unravel_index(np.argmax(predictionallframeanimal , axis=None), predictionallframeanimal.shape)[0]
+            self.keyframes[k] = kframetotal[rangenonempty[kmax]]
+            self.bestboxes[k] = bestboxesallframe[rangenonempty[kmax]]
+        self.count[k] = maxcount
+
+    def __predictFrames(self, rangeframe, frames, cached, predictionallframe, bestboxesallframe, rangegroup, fingerprint, kframetotal,
+                        crops, tocache):
+        """
+        Detects frames of indices rangeframe, filling predictionallframe and bestboxesallframe, and puts their animal crops
+        in crops, or uses their cached outputs (see readFrames), by frame position in kframetotal.
+        The new outputs are added to tocache, to cache once classified.
+        Static frames against the frames of indices rangegroup are not detected, with the motion prefilter
+        :return: indices of the non empty frames, max animal count
+        """
+        rangeanimal = []
+        croppedimages = []
+        rangenonempty = []
+        maxcount = 0
+        frames = self.staticImages(rangeframe, frames, rangegroup)
+        # detecting in all frames at once
+        detections = self.detector.bestBoxDetectionOnBatch(frames)
+        for i, k in enumerate(rangeframe):
+            if cached[i] is not None: # outputs of a previous run
+                category, box, count, humanboxes, logits = cached[i]
+            else:
+                croppedimage, category, box, count, humanboxes = detections[i]
+                if self.cache is not None:
+                    tocache.append((fingerprint, detections[i], predictionallframe[k], kframetotal[k]))
+            bestboxesallframe[k] = box
+            if count>maxcount:
+                maxcount = count
+            if category > 0: # not empty
+                rangenonempty.append(k)
+                predictionallframe[k,-1] = 0.
+            if category == 1 and cached[i] is not None: # animal, already classified
+                predictionallframe[k,0:len(txt_animalclasses[self.LANG])] = logits
+            elif category == 1: # animal
+                croppedimages.append(croppedimage)
+                rangeanimal.append(k)
+            if category == 2: # human
+                predictionallframe[k,self.idxhuman] = DEFAULTLOGIT
+            if category == 3: # vehicle
+                predictionallframe[k,self.idxvehicle] = DEFAULTLOGIT
+            if len(humanboxes): # humans in at least one frame
+                self.humancount[self.k1] = max(self.humancount[self.k1],len(humanboxes))
+        # species predicted with the crops of the next videos, in the order of rangeanimal
+        crops.put(croppedimages, predictionallframe, rangeanimal)
+        return rangenonempty, maxcount
+
+    def __cacheFrames(self, tocache):
+        """
+        Caches the outputs of the frames of tocache (see __predictFrames), once classified
+        """
+        if self.cache is not None:
+            for fingerprint, detection, prediction, position in tocache:
+                self.cacheOutputs(fingerprint, detection, prediction[0:len(txt_animalclasses[self.LANG])], position)
+            self.cache.flush()
+
+    def __stableDecision(self, predictionallframe, rangeread, previousdecision):
+        """
+        Decision on the frames analysed so far, as in __averageLogitInSequence.
+        It is stable when it is confident (score above the threshold with a margin for animals) and either
+        all the frames read lead to the same class, or it did not change since the previous step.
+        :return: decision, stability
+        """
+        _, score, decision = self._PredictorBase__averageLogitInSequence(predictionallframe)
+        nbanimalclasses = len(txt_animalclasses[self.LANG])
+        isanimal = decision not in [txt_empty[self.LANG], txt_classes[self.LANG][self.idxhuman], txt_classes[self.LANG][self.idxvehicle]]
+        if isanimal and score<self.threshold+EARLYEXIT_MARGIN:
+            return decision, False
+        framedecisions = set()
+        for k in rangeread:
+            if predictionallframe[k,-1]>0:
+                framedecisions.add(-1) # empty
+            elif predictionallframe[k,self.idxhuman]>0:
+                framedecisions.add(self.idxhuman)
+            elif predictionallframe[k,self.idxvehicle]>0:
+                framedecisions.add(self.idxvehicle)
+            else:
+                logits = predictionallframe[k,0:nbanimalclasses].copy()
+                logits[self.idxforbidden] = -np.inf
+                framedecisions.add(int(np.argmax(logits)))
+        return decision, len(framedecisions)<=1 or decision == previousdecision
+
+    def getFramesSaved(self):
+        """
+        :return: number of frames not analysed thanks to early exit, number of frames to analyse without it
+        """
+        return self.nbframessaved, self.nbframestotal
+
+    def getCheckpoint(self):
+        checkpoint = PredictorBase.getCheckpoint(self)
+        checkpoint["keyframes"] = self.keyframes[:checkpoint["k1"]]
+        return checkpoint
+
+    def getDetectionState(self):
+        detectionstate = PredictorBase.getDetectionState(self)
+        detectionstate.update(nbframestotal=self.nbframestotal, nbframessaved=self.nbframessaved)
+        return detectionstate
+
+    def restoreCheckpoint(self, checkpoint):
+        if not PredictorBase.restoreCheckpoint(self, checkpoint):
+            return False
+        self.k2 = self.k1+1
+        self.keyframes[:self.k1] = checkpoint["keyframes"]
+        self.nbframestotal, self.nbframessaved = checkpoint["nbframestotal"], checkpoint["nbframessaved"]
+        return True
 
     def getKeyFrames(self, index):
         return self.keyframes[index]
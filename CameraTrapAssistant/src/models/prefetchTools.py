@@ -0,0 +1,76 @@
+"""
+Read-ahead of input files, decoded in background threads while the models run.
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+PREFETCH_WORKERS = 2 # number of reading/decoding threads, 0 to read on the inference thread
+PREFETCH_MAXMEMORY = 1024 # MB of decoded data kept ahead of the models
+
+def sizeofDecoded(value):
+    """
+    Approximate size in bytes of a decoded item (numpy arrays, possibly nested in lists/tuples).
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (list, tuple)):
+        return sum(sizeofDecoded(v) for v in value)
+    return 0
+
+class Prefetcher:
+    """
+    Reads keys[k] with loader(keys[k]) ahead of time, in nbworkers background threads.
+    Items are requested in increasing order with get(k); at most depth items are read
+    ahead of the current one, and reading ahead is paused while the decoded items that
+    are not consumed yet exceed maxmemory MB.
+    """
+    def __init__(self, keys, loader, depth, nbworkers=PREFETCH_WORKERS, maxmemory=PREFETCH_MAXMEMORY):
+        self.keys = keys
+        self.loader = loader
+        self.depth = depth
+        self.maxbytes = maxmemory*1024*1024
+        self.executor = ThreadPoolExecutor(max_workers=nbworkers, thread_name_prefix="prefetch") if nbworkers>0 and len(keys) else None
+        self.futures = dict() # index -> future
+        self.knext = 0 # next index to submit
+        self.avgbytes = 0. # running average size of an item, to account for items being read
+
+    def get(self, k):
+        if self.executor is None:
+            return self.loader(self.keys[k])
+        # items before k will not be requested anymore
+        for kold in [kold for kold in self.futures if kold<k]:
+            self.futures.pop(kold).cancel()
+        self.knext = max(self.knext, k)
+        self.__fill(k)
+        future = self.futures.pop(k, None)
+        value = self.loader(self.keys[k]) if future is None else future.result()
+        self.avgbytes = 0.9*self.avgbytes+0.1*sizeofDecoded(value) if self.avgbytes else float(sizeofDecoded(value))
+        if k>=len(self.keys)-1:
+            self.close()
+        else:
+            self.__fill(k+1)
+        return value
+
+    def __pendingBytes(self):
+        pending = 0.
+        for future in self.futures.values():
+            if future.done() and not future.cancelled() and future.exception() is None:
+                pending += sizeofDecoded(future.result())
+            else:
+                pending += self.avgbytes
+        return pending
+
+    def __fill(self, kstart):
+        while self.knext<len(self.keys) and self.knext<kstart+self.depth:
+            if len(self.futures) and self.__pendingBytes()>=self.maxbytes:
+                break # memory cap reached, waiting for the models to consume
+            self.futures[self.knext] = self.executor.submit(self.loader, self.keys[self.knext])
+            self.knext += 1
+
+    def close(self):
+        if self.executor is not None:
+            logging.debug("Stopping prefetch threads")
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+            self.futures = dict()
@@ -0,0 +1,76 @@
+"""
+Sampling of the frames to analyse in a video.
+"""
+import cv2
+
+FRAME_SAMPLING = "auto" # "auto", "grab" (decode forward only) or "seek" (seek to every frame)
+SEEK_COST_SECONDS = 2. # a seek decodes again from the previous keyframe, about one GOP of trail camera videos
+
+def getFramePositions(total_frames, fps, nbframes):
+    """
+    :return: positions of the nbframes frames to analyse
+    """
+    # lag between two successive frames,
+    # first 2/3*nbframes spaced with a small lag for the video beginning
+    # next 1/3*nbframes spaced with a large lag for the remaining video
+    nbframebegin = int(nbframes*2/3+0.5)
+    nbframeremain = nbframes-nbframebegin
+    lagbegin = int(fps/3)
+    while((nbframebegin-1)*lagbegin>total_frames):
+        lagbegin = lagbegin-1 # reducing lagbegin if video duration is small
+    kframebegin = [k*lagbegin for k in range(0,nbframebegin)]
+    lagremain = int( (total_frames-kframebegin[-1])/nbframeremain )
+    if lagremain>0:
+        kframeremain = [kframebegin[-1]+(k+1)*lagremain for k in range(0,nbframeremain)]
+    else:
+        kframeremain = []
+    return kframebegin+kframeremain
+
+def getFramePriority(nbframes):
+    """
+    :return: indices of nbframes frames ordered so that the first ones are spread over the video:
+    first and last frames, then the successive midpoints
+    """
+    priority = [0, nbframes-1][:nbframes]
+    intervals = [(0, nbframes-1)]
+    while len(intervals):
+        nextintervals = []
+        for kbegin, kend in intervals:
+            if kend-kbegin>1:
+                kmiddle = (kbegin+kend)//2
+                priority.append(kmiddle)
+                nextintervals += [(kbegin, kmiddle), (kmiddle, kend)]
+        intervals = nextintervals
+    return priority
+
+def readFramePositions(videocap, kframes, strategy=FRAME_SAMPLING, maxgrab=None):
+    """
+    Reads the frames at positions kframes (increasing order expected), from the current position of videocap,
+    so that a capture kept open reads the next frames of a video without decoding again from its beginning.
+    With "grab", the skipped frames are only grabbed (demuxed and decoded, without color conversion)
+    and the targets retrieved, a target before the current position being seeked to. With "auto", the next target is grabbed up to if it is at most maxgrab
+    frames ahead, and seeked to otherwise; by default maxgrab is SEEK_COST_SECONDS of video.
+    :return: indices in kframes of the frames successfully read, and these frames (cv2 BGR)
+    """
+    if maxgrab is None:
+        maxgrab = int(SEEK_COST_SECONDS*videocap.get(cv2.CAP_PROP_FPS))
+    rangeframe = []
+    frames = []
+    kpos = int(videocap.get(cv2.CAP_PROP_POS_FRAMES)) # position of the next frame to decode
+    for k, kframe in enumerate(kframes):
+        ret = True
+        if strategy == "seek" or kframe<kpos or (strategy == "auto" and kframe-kpos>maxgrab):
+            videocap.set(cv2.CAP_PROP_POS_FRAMES, kframe)
+        else:
+            while kpos<kframe and ret:
+                ret = videocap.grab()
+                kpos = kpos+1
+        kpos = kframe+1
+        if ret:
+            ret,frame = videocap.read()
+        if ret == False:
+            pass # Corrupted or unavailable image, considered as empty
+        else:
+            rangeframe.append(k)
+            frames.append(frame)
+    return rangeframe, frames
@@ -0,0 +1,120 @@
+"""
+Measures the throughput of the detector and the classifier on this machine for candidate batch sizes
+and torch threads, and saves the best settings in the hardware profile (see models/hardwareProfile.py),
+used instead of the default constants by the predictors and the prediction processes.
+
+Usage: python autotune.py [--detector DF] [--batch-sizes 1 2 4 8 16] [--threads 1 2 4] [--interop 1 2]
+                          [--images 16] [--no-weights] [--dry-run]
+
+Each image is detected and one crop per image is classified, as for a folder full of animals.
+Torch sets the inter-op threads once per process: each inter-op candidate is measured in a new process.
+The throughput of the machine is estimated as the one of a process times the number of processes
+sharing the cores (cores // threads, see performance setting threads_per_worker).
+A batch size running out of memory, and the larger ones, are skipped.
+The video frames per file are not tuned, they change the predictions.
+--no-weights measures the DF detector architecture (YOLOv8s) and the classifier with random weights,
+when the weights are not available: the throughput is the same.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from detectTools import Detector, YOLOEnsemble, DFYOLO_NAME, DFYOLO_WIDTH, DFYOLO_THRES
+from classifTools import Classifier, CROP_SIZE, DFVIT_WEIGHTS
+from hardwareProfile import saveHardwareProfile, isOutOfMemory, releaseMemory, HARDWARE_PROFILE
+
+IMAGE_SHAPE = (1080, 1920, 3) # camera trap image, letterboxed by the detector
+
+def loadModels(detectorname, noweights, device):
+    if noweights:
+        detector = YOLOEnsemble("yolov8s.yaml", imgszA=DFYOLO_WIDTH, thresA=DFYOLO_THRES)
+    else:
+        detector = Detector(name=detectorname, device=device).yolo
+    classifier = Classifier(device, weights=None if noweights else DFVIT_WEIGHTS)
+    return detector, classifier
+
+def imagesPerSecond(detector, classifier, images, crops, batchsize, device):
+    batches = [range(k, min(k+batchsize, len(images))) for k in range(0, len(images), batchsize)]
+    def predict(batch):
+        detector.predictOnBatch([images[k] for k in batch], device=device)
+        classifier.predictOnBatch(crops[batch.start:batch.stop], withsoftmax=False)
+    predict(batches[0]) # warm-up
+    start = time.perf_counter()
+    for batch in batches:
+        predict(batch)
+    return len(images)/(time.perf_counter()-start)
+
+def measure(interop, threads, batchsizes, nbimages, detectorname, noweights):
+    """
+    Throughput of a process with interop inter-op threads, for each number of threads and batch size.
+    :return: list of (threads, batch size, images per second), None when out of memory
+    """
+    torch.set_num_interop_threads(interop)
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    detector, classifier = loadModels(detectorname, noweights, device)
+    rng = np.random.default_rng(0)
+    images = [rng.integers(0, 256, IMAGE_SHAPE, dtype=np.uint8) for _ in range(nbimages)]
+    crops = torch.randn((nbimages, 3, CROP_SIZE, CROP_SIZE))
+    measures = []
+    for nbthreads in threads:
+        torch.set_num_threads(nbthreads)
+        for batchsize in batchsizes:
+            try:
+                rate = imagesPerSecond(detector, classifier, images, crops, batchsize, device)
+            except Exception as err:
+                if not isOutOfMemory(err):
+                    raise err
+                releaseMemory()
+                measures.append((nbthreads, batchsize, None))
+                break # larger batches would not fit either
+            measures.append((nbthreads, batchsize, rate))
+            print(f"  interop {interop}, threads {nbthreads}, batch {batchsize}: {rate:.2f} images/s", flush=True)
+    return measures
+
+def main():
+    nbcores = os.cpu_count() or 1
+    defaultthreads = sorted({t for t in [1, 2, 4, 8, 16, 32, 64] if t <= nbcores} | {nbcores})
+    parser = argparse.ArgumentParser(description="Measure the best batch size and threads on this machine")
+    parser.add_argument("--detector", default=DFYOLO_NAME, help="detector name, see models/detectTools.py")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16], help="images per batch")
+    parser.add_argument("--threads", type=int, nargs="+", default=defaultthreads, help="torch intra-op threads per process")
+    parser.add_argument("--interop", type=int, nargs="+", default=[1, 2], help="torch inter-op threads per process")
+    parser.add_argument("--images", type=int, default=16, help="images timed per measure")
+    parser.add_argument("--no-weights", action="store_true", help="random weights instead of the DeepFaune ones")
+    parser.add_argument("--dry-run", action="store_true", help="only print the measures")
+    args = parser.parse_args()
+    batchsizes = sorted(set(args.batch_sizes))
+    nbimages = max(args.images, batchsizes[-1])
+
+    print(f"{nbcores} cores, {'GPU '+torch.cuda.get_device_name(0) if torch.cuda.is_available() else 'no GPU'}")
+    measures = []
+    for interop in args.interop:
+        with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as executor:
+            for nbthreads, batchsize, rate in executor.submit(measure, interop, args.threads, batchsizes, nbimages,
+                                                              args.detector, args.no_weights).result():
+                if rate is None:
+                    print(f"  interop {interop}, threads {nbthreads}, batch {batchsize}: out of memory")
+                    continue
+                measures.append({"interop_threads": interop, "threads_per_worker": nbthreads, "photo_batch_size": batchsize,
+                                 "images_per_second": rate, "machine_images_per_second": rate*max(1, nbcores//nbthreads)})
+    if not len(measures):
+        sys.exit("No setting could be measured")
+
+    best = max(measures, key=lambda m: m["machine_images_per_second"])
+    settings = {name: best[name] for name in ["photo_batch_size", "threads_per_worker", "interop_threads"]}
+    print(f"Best: {settings}, {best['images_per_second']:.2f} images/s per process, "
+          f"{best['machine_images_per_second']:.2f} images/s estimated for the machine")
+    if not args.dry_run:
+        saveHardwareProfile(settings, measures)
+        print(f"Saved in {HARDWARE_PROFILE}")
+
+if __name__ == "__main__":
+    main()
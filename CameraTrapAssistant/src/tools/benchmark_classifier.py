@@ -0,0 +1,60 @@
+"""
+Throughput of the classifier on CROP_SIZE crops (see models/classifTools.py).
+
+Usage: python benchmark_classifier.py [--batch 8] [--batches 10] [--threads N] [--compile] [--no-weights]
+
+Compares the historical Model.predict path with the InferenceEngine, reports images per second
+and the largest difference between their logits.
+--no-weights uses random weights, when the DeepFaune weights are not available: the throughput is the same.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from classifTools import Model, InferenceEngine, CROP_SIZE, DFVIT_WEIGHTS
+
+def throughput(predict, batches):
+    predict(batches[0]) # warm-up, and compilation if any
+    start = time.perf_counter()
+    outputs = [predict(batch) for batch in batches]
+    elapsed = time.perf_counter()-start
+    return sum(len(batch) for batch in batches)/elapsed, np.concatenate(outputs)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the classifier inference")
+    parser.add_argument("--batch", type=int, default=8, help="crops per batch (PredictorImage BATCH_SIZE)")
+    parser.add_argument("--batches", type=int, default=10, help="batches timed")
+    parser.add_argument("--threads", type=int, default=None, help="torch intra-op threads")
+    parser.add_argument("--compile", action="store_true", help="also benchmark the engine with torch.compile")
+    parser.add_argument("--no-weights", action="store_true", help="random weights instead of DFVIT_WEIGHTS")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    device = torch.device("cpu")
+    model = Model(device)
+    if not args.no_weights:
+        model.loadWeights(DFVIT_WEIGHTS)
+    torch.manual_seed(0)
+    batches = [torch.randn((args.batch,3,CROP_SIZE,CROP_SIZE)) for _ in range(args.batches)]
+    print(f"{args.batches} batches of {args.batch} crops {CROP_SIZE}x{CROP_SIZE}, {torch.get_num_threads()} threads")
+
+    reference, reference_output = throughput(lambda batch: model.predict(batch, withsoftmax=False), batches)
+    print(f"Model.predict: {reference:.2f} images/s")
+    engine = InferenceEngine(model, device)
+    rate, output = throughput(lambda batch: engine.predict(batch, withsoftmax=False), batches)
+    print(f"InferenceEngine: {rate:.2f} images/s, speedup x{rate/reference:.2f}, "
+          f"max logit difference {np.abs(output-reference_output).max():.2e}")
+    if args.compile:
+        engine.compile()
+        rate, output = throughput(lambda batch: engine.predict(batch, withsoftmax=False), batches)
+        print(f"InferenceEngine compiled: {rate:.2f} images/s, speedup x{rate/reference:.2f}, "
+              f"max logit difference {np.abs(output-reference_output).max():.2e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Benchmark of the video frame sampling strategies (see models/videoTools.py).
+
+Usage: python benchmark_frame_sampling.py FOLDER [--nbframes 12] [--repeat 1]
+
+For each video in FOLDER, reads the frames analysed by PredictorVideo with every strategy,
+reports the mean time per video and checks that the frames are the same as with "seek",
+the historical behavior.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from videoTools import getFramePositions, readFramePositions
+
+VIDEO_PATTERNS = ['*.[Aa][Vv][Ii]', '*.[Mm][Pp]4', '*.[Mm][Pp][Ee][Gg]', '*.[Mm][Oo][Vv]', '*.[Mm]4[Vv]']
+STRATEGIES = ["seek", "grab", "auto"]
+
+def readVideo(filename, nbframes, strategy):
+    videocap = cv2.VideoCapture(filename)
+    total_frames = int(videocap.get(cv2.CAP_PROP_FRAME_COUNT))
+    frames = []
+    if total_frames>0:
+        kframes = getFramePositions(total_frames, int(videocap.get(5)), nbframes)
+        _, frames = readFramePositions(videocap, kframes, strategy=strategy)
+    videocap.release()
+    return frames
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare video frame sampling strategies")
+    parser.add_argument("folder")
+    parser.add_argument("--nbframes", type=int, default=12, help="frames sampled per video (PredictorVideo BATCH_SIZE)")
+    parser.add_argument("--repeat", type=int, default=1, help="runs per strategy and video, the best one is kept")
+    args = parser.parse_args()
+
+    filenames = sorted(str(f) for pattern in VIDEO_PATTERNS for f in Path(args.folder).rglob(pattern))
+    if not filenames:
+        sys.exit(f"No video files found in folder {args.folder}")
+    print(f"{len(filenames)} videos, {args.nbframes} frames per video")
+
+    timings = {strategy: [] for strategy in STRATEGIES}
+    mismatches = {strategy: 0 for strategy in STRATEGIES}
+    for filename in filenames:
+        reference = None
+        for strategy in STRATEGIES:
+            best = float("inf")
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                frames = readVideo(filename, args.nbframes, strategy)
+                best = min(best, time.perf_counter()-start)
+            timings[strategy].append(best)
+            if reference is None:
+                reference = frames
+            elif len(frames) != len(reference) or any(np.abs(f.astype(np.int16)-r).mean()>1. for f, r in zip(frames, reference)):
+                mismatches[strategy] += 1
+
+    for strategy in STRATEGIES:
+        t = np.array(timings[strategy])
+        print(f"{strategy:>5}: mean {t.mean():.3f} s/video, median {np.median(t):.3f} s/video, "
+              f"speedup x{np.sum(timings['seek'])/np.sum(t):.2f}, videos with different frames: {mismatches[strategy]}")
+
+if __name__ == "__main__":
+    main()
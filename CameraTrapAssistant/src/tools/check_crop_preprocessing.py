@@ -0,0 +1,62 @@
+"""
+Check of the batched crop preprocessing (Classifier.preprocessCrops) against the PIL one (Classifier.preprocessImage).
+
+Usage: python check_crop_preprocessing.py FOLDER [--crops 8] [--max-images N]
+
+Random square-ish boxes are cropped from the images of FOLDER and preprocessed both ways.
+Reports the time per batch of crops and the differences, in 1/255 of the intensity range.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from classifTools import Classifier, CROP_SIZE, CROP_STD
+from detectTools import imreadCV, cropSquareCV, cropSquareCVtoPIL
+
+IMAGE_PATTERNS = ['*.[Jj][Pp][Gg]', '*.[Jj][Pp][Ee][Gg]', '*.[Pp][Nn][Gg]']
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the batched and PIL crop preprocessing")
+    parser.add_argument("folder")
+    parser.add_argument("--crops", type=int, default=8, help="crops per image, preprocessed as a batch")
+    parser.add_argument("--max-images", type=int, default=None)
+    args = parser.parse_args()
+
+    filenames = sorted(str(f) for pattern in IMAGE_PATTERNS for f in Path(args.folder).rglob(pattern))[:args.max_images]
+    if not filenames:
+        sys.exit(f"No image files found in folder {args.folder}")
+    classifier = Classifier(weights=None) # preprocessing only
+    rng = np.random.default_rng(0)
+    std = torch.tensor(CROP_STD).view(1,3,1,1)
+    timepil, timebatch, maxdiff, meandiff = 0., 0., 0., []
+    out = torch.empty((args.crops,3,CROP_SIZE,CROP_SIZE))
+    for filename in filenames:
+        imagecv = imreadCV(filename)
+        if imagecv is None:
+            continue
+        height, width, _ = imagecv.shape
+        boxes = []
+        for _ in range(args.crops):
+            x1, y1 = rng.uniform(0, width*0.8), rng.uniform(0, height*0.8)
+            boxes.append(np.array([x1, y1, rng.uniform(x1+8, width), rng.uniform(y1+8, height)]))
+        start = time.perf_counter()
+        reference = torch.cat([classifier.preprocessImage(cropSquareCVtoPIL(imagecv, box.copy())) for box in boxes])
+        timepil += time.perf_counter()-start
+        start = time.perf_counter()
+        classifier.preprocessCrops([cropSquareCV(imagecv, box.copy()) for box in boxes], out)
+        timebatch += time.perf_counter()-start
+        diff = ((out-reference)*std).abs()*255 # back to the intensity range
+        maxdiff = max(maxdiff, diff.max().item())
+        meandiff.append(diff.mean().item())
+    print(f"{len(meandiff)} images, {args.crops} crops per image")
+    print(f"PIL: {1000*timepil/len(meandiff):.2f} ms/batch, batched: {1000*timebatch/len(meandiff):.2f} ms/batch, "
+          f"speedup x{timepil/timebatch:.2f}")
+    print(f"Difference (1/255): max {maxdiff:.2f}, mean {np.mean(meandiff):.4f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Recall of the motion prefilter (see models/motionTools.py) against the full detector, on a sample of files.
+
+Usage: python check_motion_prefilter.py FOLDER [--min-area 0.001 0.002 0.005] [--max-files N] [--maxlag 10] [--detector DF]
+
+The photos and videos of FOLDER are predicted without the prefilter, then with it for each --min-area.
+Reports the share of photos/frames that skipped the detector, the recall (files with a detection
+without the prefilter that still have one) and the agreement of the predicted classes.
+Choose the motion_min_area performance setting from it: the lower, the more conservative.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from predictTools import PredictorImage, PredictorVideo, txt_empty
+from detectTools import Detector, DFYOLO_NAME
+from classifTools import Classifier
+from motionTools import MOTION_MIN_AREA
+
+IMAGE_PATTERNS = ['*.[Jj][Pp][Gg]', '*.[Jj][Pp][Ee][Gg]', '*.[Pp][Nn][Gg]']
+VIDEO_PATTERNS = ['*.[Aa][Vv][Ii]', '*.[Mm][Pp]4', '*.[Mm][Oo][Vv]', '*.[Mm]4[Vv]']
+LANG = "en"
+
+def predict(filenames, isvideo, args, classifier, detector, motionminarea):
+    start = time.perf_counter()
+    if isvideo:
+        predictor = PredictorVideo(filenames, 0.5, LANG, classifier=classifier, detector=detector, motionminarea=motionminarea)
+    else:
+        predictor = PredictorImage(filenames, 0.5, args.maxlag, LANG, classifier=classifier, detector=detector,
+                                   motionminarea=motionminarea)
+    predictor.allBatch()
+    elapsed = time.perf_counter()-start
+    if isvideo: # a video is non empty when at least one of its frames has a detection
+        nonempty = [predictedclass != txt_empty[LANG] for predictedclass in predictor.getPredictions()[0]]
+    else: # a photo is non empty when it has a detection, whatever its sequence
+        nonempty = list(predictor.prediction[:,-1]==0)
+    results = dict(zip(predictor.getFilenames(), zip(nonempty, predictor.getPredictions()[0])))
+    return results, predictor.getMotionSkipped(), elapsed
+
+def report(name, filenames, isvideo, args, classifier, detector):
+    reference, _, reftime = predict(filenames, isvideo, args, classifier, detector, None)
+    nbnonempty = sum(nonempty for nonempty, _ in reference.values())
+    print(f"{name}: {len(filenames)} files, {nbnonempty} with a detection, {reftime:.1f}s without prefilter")
+    for minarea in args.min_area:
+        results, (skipped, checked), elapsed = predict(filenames, isvideo, args, classifier, detector, minarea)
+        kept = sum(reference[f][0] and results[f][0] for f in filenames)
+        agreement = sum(reference[f][1] == results[f][1] for f in filenames)/len(filenames)
+        print(f"  min area {minarea}: detector skipped on {skipped}/{checked} {'frames' if isvideo else 'photos'} "
+              f"({skipped/max(1,checked):.1%}), recall {kept}/{nbnonempty} ({kept/max(1,nbnonempty):.1%}), "
+              f"class agreement {agreement:.1%}, {elapsed:.1f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Check the recall of the motion prefilter against the full detector")
+    parser.add_argument("folder")
+    parser.add_argument("--min-area", type=float, nargs="+", default=[MOTION_MIN_AREA/2, MOTION_MIN_AREA, MOTION_MIN_AREA*2])
+    parser.add_argument("--max-files", type=int, default=None, help="photos and videos sampled, all by default")
+    parser.add_argument("--maxlag", type=int, default=10, help="seconds between two photos of the same sequence")
+    parser.add_argument("--detector", default=DFYOLO_NAME)
+    args = parser.parse_args()
+
+    photos = sorted(str(f) for pattern in IMAGE_PATTERNS for f in Path(args.folder).rglob(pattern))[:args.max_files]
+    videos = sorted(str(f) for pattern in VIDEO_PATTERNS for f in Path(args.folder).rglob(pattern))[:args.max_files]
+    if not photos and not videos:
+        sys.exit(f"No photo or video files found in folder {args.folder}")
+    classifier = Classifier()
+    detector = Detector(name=args.detector)
+    if photos:
+        report("Photos", photos, False, args, classifier, detector)
+    if videos:
+        report("Videos", videos, True, args, classifier, detector)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+Export of the detectors and the classifier to ONNX, for the onnx backend (see models/onnxTools.py).
+
+Usage: python export_onnx.py [--models DF MDS MDR classifier] [--opset 17]
+
+Each .onnx file is written next to its .pt weights, where Detector and Classifier look for it.
+The batch dimension is dynamic, so that batches of any size can be predicted.
+Set backend = onnx in the [performance] section of the GUI config file to use them.
+"""
+import argparse
+import inspect
+import sys
+from pathlib import Path
+
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from detectTools import DFYOLO_WEIGHTS, DFYOLO_WIDTH, MDSYOLO_WEIGHTS, MDSYOLO_WIDTH, MDRYOLO_WEIGHTS, MDRYOLO_WIDTH, \
+    DFYOLO_NAME, MDSYOLO_NAME, MDRYOLO_NAME, loadPickled
+from classifTools import Model, DFVIT_WEIGHTS, CROP_SIZE
+from onnxTools import onnxPath
+
+class FirstOutput(torch.nn.Module):
+    # yolov5 models return (predictions, features), only the predictions are used
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model(x)[0]
+
+def exportTorch(model, size, path, opset):
+    # TorchScript exporter, the default one up to torch 2.8, whose dynamo argument only exists from torch 2.5
+    options = dict(dynamo=False) if "dynamo" in inspect.signature(torch.onnx.export).parameters else dict()
+    torch.onnx.export(model.eval(), torch.zeros((1,3,size,size)), path, opset_version=opset,
+                      input_names=["images"], output_names=["output"],
+                      dynamic_axes={"images": {0: "batch"}, "output": {0: "batch"}}, **options)
+
+def exportUltralytics(weights, width, opset):
+    from ultralytics import YOLO
+    # dynamic input size, so that images are letterboxed as with the .pt weights
+    exported = YOLO(weights).export(format="onnx", imgsz=width, dynamic=True, opset=opset)
+    print(f"{weights} -> {exported}")
+
+def exportRedwood(opset):
+    model = loadPickled(MDRYOLO_WEIGHTS, "cpu")["model"].float().fuse().eval()
+    for m in model.modules():
+        if isinstance(m, torch.nn.Upsample):
+            m.recompute_scale_factor = None
+    exportTorch(FirstOutput(model), MDRYOLO_WIDTH, onnxPath(MDRYOLO_WEIGHTS), opset)
+    print(f"{MDRYOLO_WEIGHTS} -> {onnxPath(MDRYOLO_WEIGHTS)}")
+
+def exportClassifier(opset):
+    model = Model(torch.device("cpu"))
+    model.loadWeights(DFVIT_WEIGHTS)
+    # positional embeddings resampled once to CROP_SIZE, instead of at each forward (bicubic antialias not in ONNX)
+    model.base_model.set_input_size(img_size=CROP_SIZE)
+    exportTorch(model, CROP_SIZE, onnxPath(DFVIT_WEIGHTS), opset)
+    print(f"{DFVIT_WEIGHTS} -> {onnxPath(DFVIT_WEIGHTS)}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the models to ONNX")
+    parser.add_argument("--models", nargs="+", default=[DFYOLO_NAME, MDSYOLO_NAME, MDRYOLO_NAME, "classifier"],
+                        choices=[DFYOLO_NAME, MDSYOLO_NAME, MDRYOLO_NAME, "classifier"])
+    parser.add_argument("--opset", type=int, default=17)
+    args = parser.parse_args()
+
+    if DFYOLO_NAME in args.models:
+        exportUltralytics(DFYOLO_WEIGHTS, DFYOLO_WIDTH, args.opset)
+    if MDSYOLO_NAME in args.models:
+        exportUltralytics(MDSYOLO_WEIGHTS, MDSYOLO_WIDTH, args.opset)
+    if MDRYOLO_NAME in args.models:
+        exportRedwood(args.opset)
+    if "classifier" in args.models:
+        exportClassifier(args.opset)
+
+if __name__ == "__main__":
+    main()
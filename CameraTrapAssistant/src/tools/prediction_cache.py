@@ -0,0 +1,45 @@
+"""
+Management of the persistent cache of the model outputs (see models/cacheTools.py).
+
+Usage: python prediction_cache.py [--clear] [--older-than DAYS] [--evict] [--max-mb MB]
+
+Without option, lists the cached entries by model identifier, without removing any. Entries of previous
+weights are never used again and are evicted after the predictions once the cache exceeds the
+prediction_cache_mb performance setting; --evict does it now, down to --max-mb MB (by default the setting).
+--older-than removes the entries not used for DAYS days, --clear removes all the entries.
+"""
+import argparse
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+from cacheTools import PredictionCache, PREDICTION_CACHE
+from gui.utils.config import load_performance_config
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or clear the prediction cache")
+    parser.add_argument("--clear", action="store_true", help="remove all the entries")
+    parser.add_argument("--older-than", type=float, default=None, help="remove the entries not used for this number of days")
+    parser.add_argument("--evict", action="store_true", help="remove the least recently used entries above --max-mb")
+    parser.add_argument("--max-mb", type=int, default=None, help="size of the cache in MB, by default the prediction_cache_mb setting")
+    args = parser.parse_args()
+    maxsize = args.max_mb if args.max_mb is not None else load_performance_config().prediction_cache_mb
+
+    if not Path(PREDICTION_CACHE).exists():
+        sys.exit(f"No prediction cache in {PREDICTION_CACHE}")
+    cache = PredictionCache(None, maxsize=maxsize)
+    if args.clear or args.older_than is not None:
+        removed = cache.clear(None if args.clear else args.older_than)
+        print(f"{removed} entries removed")
+    if args.evict:
+        cache.evict()
+    print(f"{PREDICTION_CACHE}, {maxsize} MB at most")
+    for modelid, nbentries, size, accessed in cache.getStats():
+        print(f"  model {modelid}: {nbentries} entries, {size/1024/1024:.1f} MB, "
+              f"last used {time.strftime('%Y-%m-%d %H:%M', time.localtime(accessed))}")
+    cache.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+"""
+Validation of the reduced-precision classifier modes against fp32 (see PRECISIONS in models/classifTools.py).
+
+Usage: python validate_classifier_precision.py FOLDER [--precisions bf16 int8] [--batch 8] [--max-crops N] [--no-weights]
+
+FOLDER holds crops of animals (or whole images), e.g. saved from previous runs. Each crop is classified
+in fp32 and in every precision, the tool reports the top-1 agreement, the logit drift and the throughput.
+The results are saved for this machine: a precision is only used by the predictors (classifier_precision
+performance setting) once its top-1 agreement reached PRECISION_MIN_AGREEMENT.
+--no-weights uses random weights, to check the speed only: nothing is saved.
+"""
+import argparse
+import copy
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "models"))
+from classifTools import Classifier, InferenceEngine, savePrecisionValidation, \
+    DFVIT_WEIGHTS, PRECISIONS, PRECISION_MIN_AGREEMENT, PRECISION_VALIDATION
+
+IMAGE_PATTERNS = ['*.[Jj][Pp][Gg]', '*.[Jj][Pp][Ee][Gg]', '*.[Pp][Nn][Gg]', '*.[Bb][Mm][Pp]', '*.[Tt][Ii][Ff][Ff]']
+
+def predictAll(predict, batches):
+    start = time.perf_counter()
+    logits = np.concatenate([predict(batch) for batch in batches])
+    return logits, len(logits)/(time.perf_counter()-start)
+
+def main():
+    parser = argparse.ArgumentParser(description="Validate the reduced-precision classifier modes against fp32")
+    parser.add_argument("folder")
+    parser.add_argument("--precisions", nargs="+", default=[p for p in PRECISIONS if p != "fp32"], choices=PRECISIONS)
+    parser.add_argument("--batch", type=int, default=8, help="crops per batch")
+    parser.add_argument("--max-crops", type=int, default=None, help="number of crops used, all by default")
+    parser.add_argument("--no-weights", action="store_true", help="random weights instead of DFVIT_WEIGHTS, results not saved")
+    args = parser.parse_args()
+
+    filenames = sorted(str(f) for pattern in IMAGE_PATTERNS for f in Path(args.folder).rglob(pattern))[:args.max_crops]
+    if not filenames:
+        sys.exit(f"No image files found in folder {args.folder}")
+    device = torch.device("cpu")
+    weights = None if args.no_weights else DFVIT_WEIGHTS
+    reference = Classifier(device, weights=weights)
+    crops = [reference.preprocessImage(Image.open(f).convert("RGB")) for f in filenames]
+    batches = [torch.cat(crops[k:k+args.batch]) for k in range(0, len(crops), args.batch)]
+    print(f"{len(crops)} crops, batches of {args.batch}, {torch.get_num_threads()} threads")
+
+    fp32logits, fp32rate = predictAll(lambda batch: reference.predictOnBatch(batch, withsoftmax=False), batches)
+    print(f" fp32: {fp32rate:.2f} crops/s")
+    for precision in args.precisions:
+        engine = InferenceEngine(copy.deepcopy(reference.model), device, precision=precision)
+        if engine.precision != precision:
+            print(f"{precision:>5}: not available on this machine")
+            continue
+        logits, rate = predictAll(lambda batch: engine.predict(batch, withsoftmax=False), batches)
+        agreement = float(np.mean(logits.argmax(axis=1) == fp32logits.argmax(axis=1)))
+        drift = np.abs(logits-fp32logits)
+        print(f"{precision:>5}: {rate:.2f} crops/s (x{rate/fp32rate:.2f}), top-1 agreement {agreement:.2%}, "
+              f"logit drift mean {drift.mean():.3f} max {drift.max():.3f}, "
+              f"{'passed' if agreement >= PRECISION_MIN_AGREEMENT else 'failed'} (minimal agreement {PRECISION_MIN_AGREEMENT:.0%})")
+        if weights is not None:
+            savePrecisionValidation(precision, agreement, float(drift.mean()), float(drift.max()), len(crops), weights)
+    if weights is not None:
+        print(f"Results saved in {PRECISION_VALIDATION}")
+
+if __name__ == "__main__":
+    main()